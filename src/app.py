@@ -1,22 +1,39 @@
 import os
 import json
-import psycopg2
+import math
 import mimetypes
 from io import BytesIO
-from flask import Flask, render_template, jsonify, request, send_file
+from flask import Flask, Response, render_template, jsonify, request, send_file
+from psycopg2 import errors
 from psycopg2.extras import RealDictCursor
 from dotenv import load_dotenv
 from azure.storage.blob import BlobServiceClient
 
+from marker_filters import category_clause, time_range_clause, time_range_bounds, parse_bbox
+from route_geometry import MAX_ROUTE_PIECES, ROUTE_PIECE_DEGREES, parse_route, route_piece_count
+from export_markers import EXPORT_FORMATS, build_export_copy, iter_export
+from db_routing import DB_DEFAULTS, DatabaseRouter, parse_hosts
+from marker_snapshot import SnapshotStore
+from single_flight import SingleFlight
+from category_facets import CATEGORY_LABELS_QUERY, CATEGORY_SUMMARY_QUERY, category_facets_query, category_counts_query
+
 # Load environment variables from .env
 load_dotenv()
 
 # Database configuration
-DB_NAME = os.getenv("DB_NAME", "geodb")
-DB_USER = os.getenv("DB_USER", "postgres")
-DB_PASS = os.getenv("DB_PASS", "defaultpassword")
-DB_HOST = os.getenv("DB_HOST", "localhost")
-DB_PORT = os.getenv("DB_PORT", "5432")
+DB_NAME = os.getenv("DB_NAME", DB_DEFAULTS["DB_NAME"])
+DB_USER = os.getenv("DB_USER", DB_DEFAULTS["DB_USER"])
+DB_PASS = os.getenv("DB_PASS", DB_DEFAULTS["DB_PASS"])
+DB_HOST = os.getenv("DB_HOST", DB_DEFAULTS["DB_HOST"])
+DB_PORT = os.getenv("DB_PORT", DB_DEFAULTS["DB_PORT"])
+# Optional read replicas ("host[:port]" list) used by the read-only routes.
+DB_REPLICA_HOSTS = os.getenv("DB_REPLICA_HOSTS", "")
+DB_REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "30"))
+DB_HEALTH_CHECK_INTERVAL = float(os.getenv("DB_HEALTH_CHECK_INTERVAL", "10"))
+
+# Optional in-memory serving: directory where marker snapshots are published.
+MARKER_SNAPSHOT_DIR = os.getenv("MARKER_SNAPSHOT_DIR")
+MARKER_SNAPSHOT_CHECK_INTERVAL = float(os.getenv("MARKER_SNAPSHOT_CHECK_INTERVAL", "2"))
 
 # Azure Blob Storage configuration
 AZURE_STORAGE_ACCOUNT = os.getenv("AZURE_STORAGE_ACCOUNT", "streetutilityimagesacct")
@@ -40,16 +57,85 @@ app = Flask(
     static_folder=static_dir
 )
 
-def get_db_connection():
-    """Establish a connection to the PostgreSQL database using environment settings."""
-    conn = psycopg2.connect(
-        dbname=DB_NAME,
-        user=DB_USER,
-        password=DB_PASS,
-        host=DB_HOST,
-        port=DB_PORT
-    )
-    return conn
+db_router = DatabaseRouter(
+    dbname=DB_NAME,
+    user=DB_USER,
+    password=DB_PASS,
+    primary=(DB_HOST, DB_PORT),
+    replicas=parse_hosts(DB_REPLICA_HOSTS, DB_PORT),
+    max_lag=DB_REPLICA_MAX_LAG,
+    check_interval=DB_HEALTH_CHECK_INTERVAL
+)
+
+snapshot_store = SnapshotStore(MARKER_SNAPSHOT_DIR, MARKER_SNAPSHOT_CHECK_INTERVAL) if MARKER_SNAPSHOT_DIR else None
+
+def current_snapshot():
+    """Return the live marker snapshot when snapshot serving is enabled and one is published."""
+    return snapshot_store.current() if snapshot_store is not None else None
+
+def get_db_connection(readonly=False):
+    """
+    Establish a connection to the PostgreSQL database using environment settings.
+    Read-only connections are routed to a healthy read replica when any is configured.
+    """
+    return db_router.connect(readonly=readonly)
+
+# Identical read queries running concurrently share a single execution.
+query_flights = SingleFlight()
+
+def fetch_all_shared(query, params=(), cursor_factory=None):
+    """
+    Run a read-only query and return all its rows. Concurrent requests for the
+    same query and parameters (e.g. many users opening the default view) wait
+    for one database execution and share its rows, which must not be modified.
+    """
+    params = tuple(params)
+
+    def run(conn):
+        cur = conn.cursor(cursor_factory=cursor_factory)
+        cur.execute(query, params)
+        rows = cur.fetchall()
+        cur.close()
+        return rows
+
+    # Routed to a replica when one is healthy, and retried on the primary if it fails there.
+    return query_flights.do((query, params, cursor_factory), lambda: db_router.run_readonly(run))
+
+# Largest k accepted by /markers/nearest.
+MAX_NEAREST_K = 200
+# The GiST KNN operator orders by planar distance in degrees, which over-weights
+# east-west offsets away from the equator (a degree of longitude is shorter than
+# a degree of latitude), so its first k rows are not always the k nearest. This
+# many times k candidates are fetched first; their k-th geodesic distance then
+# bounds an exact second pass (see markers_nearest).
+KNN_CANDIDATE_FACTOR = 4
+# Slightly less than the length of one degree of latitude, so that degree
+# envelopes derived from a metric radius always cover that radius.
+METERS_PER_DEGREE = 110000.0
+
+def degree_buffer(lat, meters):
+    """Return the (dlat, dlon) offsets in degrees covering `meters` around latitude lat."""
+    dlat = meters / METERS_PER_DEGREE
+    dlon = meters / (METERS_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01))
+    return dlat, dlon
+
+# Limit for /markers/along: corridor half-width in meters.
+MAX_CORRIDOR_BUFFER = 500.0
+
+def category_filter():
+    """
+    Build the label filter from the optional comma separated 'categories' query parameter.
+    Returns (clause, params) where clause starts with ' AND' (or is empty).
+    """
+    return category_clause(request.args.get('categories'))
+
+def time_range_filter():
+    """
+    Build the capture-time filter from the optional 'from' and 'to' query parameters.
+    Returns (clause, params) where clause starts with ' AND' (or is empty).
+    Raises ValueError if a bound is malformed.
+    """
+    return time_range_clause(request.args.get('from'), request.args.get('to'))
 
 @app.route('/')
 def index():
@@ -57,46 +143,97 @@ def index():
 
 @app.route('/categories')
 def categories():
-    query = "SELECT DISTINCT label FROM markers ORDER BY label;"
+    """
+    List the marker labels. With bbox=minlat,minlon,maxlat,maxlon, return instead
+    the number of markers of each label in that viewport (labels without markers
+    there are omitted), from the snapshot when one is published and otherwise from
+    the facet cells precomputed at ingest (see category_facets.py).
+    """
+    bbox_param = request.args.get('bbox')
+    bbox = None
+    if bbox_param:
+        try:
+            bbox = parse_bbox(*bbox_param.split(','))
+        except (TypeError, ValueError):
+            return jsonify({"error": "Invalid 'bbox' parameter, expected minlat,minlon,maxlat,maxlon."}), 400
+
+    snapshot = current_snapshot()
+    if snapshot is not None:
+        if bbox is None:
+            return jsonify(snapshot.labels)
+        return jsonify(snapshot.label_counts(snapshot.query(*bbox)))
+
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute(query)
-        results = cur.fetchall()
-        cur.close()
-        conn.close()
+        if bbox is not None:
+            try:
+                rows = fetch_all_shared(*category_facets_query(bbox), RealDictCursor)
+            except errors.UndefinedTable:
+                # Facet tables not created yet: the database predates them.
+                rows = fetch_all_shared(*category_counts_query(bbox), RealDictCursor)
+            return jsonify(rows)
+        try:
+            results = fetch_all_shared(CATEGORY_LABELS_QUERY)
+        except errors.UndefinedTable:
+            # Facet tables not created yet: the database predates them.
+            results = []
+        if not results:
+            # The live generation has no summary (loaded before summaries existed).
+            results = fetch_all_shared("SELECT DISTINCT label FROM markers ORDER BY label;")
         cats = [row[0] for row in results]
         return jsonify(cats)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/categories/summary')
+def categories_summary():
+    """
+    Per-label totals of the live generation, computed at ingest: marker count,
+    score range, bounds and capture-time range. Empty on a database that
+    predates the summary tables.
+    """
+    try:
+        try:
+            rows = fetch_all_shared(CATEGORY_SUMMARY_QUERY, (), RealDictCursor)
+        except errors.UndefinedTable:
+            # Facet tables not created yet: the database predates them.
+            rows = []
+        return jsonify(rows)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/markers')
 def markers():
     try:
-        minlat = float(request.args.get('minlat'))
-        minlon = float(request.args.get('minlon'))
-        maxlat = float(request.args.get('maxlat'))
-        maxlon = float(request.args.get('maxlon'))
+        minlat, minlon, maxlat, maxlon = parse_bbox(
+            request.args.get('minlat'), request.args.get('minlon'),
+            request.args.get('maxlat'), request.args.get('maxlon')
+        )
     except (TypeError, ValueError):
         return jsonify({"error": "Missing or invalid bounding box parameters."}), 400
 
+    try:
+        time_clause, time_params = time_range_filter()
+    except ValueError:
+        return jsonify({"error": "Invalid 'from'/'to' parameters, expected ISO 8601 dates."}), 400
+
+    snapshot = current_snapshot()
+    if snapshot is not None:
+        time_from, time_to = time_range_bounds(request.args.get('from'), request.args.get('to'))
+        idx = snapshot.query(minlat, minlon, maxlat, maxlon, time_from=time_from, time_to=time_to)
+        return Response(snapshot.markers_json(idx), mimetype='application/json')
+
     envelope = f"ST_MakeEnvelope({minlon}, {minlat}, {maxlon}, {maxlat}, 4326)"
     # Include source_path and object_depth in the select query.
     base_query = f"""
         SELECT id, label, score, projection_path, detection_path, crop_path, depth_path,
-               source_path, object_depth,
+               source_path, object_depth, captured_at,
                ST_AsGeoJSON(geom) AS geom,
                ST_AsGeoJSON(bounding_box) AS bounding_box
         FROM markers
-        WHERE geom && {envelope}
+        WHERE geom && {envelope} {time_clause}
     """
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute(base_query)
-        rows = cur.fetchall()
-        cur.close()
-        conn.close()
+        rows = fetch_all_shared(base_query, time_params, RealDictCursor)
         return jsonify(rows)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -108,13 +245,13 @@ def markers_clustered():
     Returns clusters of markers using server-side clustering.
     Markers within cluster_distance (in degrees) are grouped together.
     For each cluster, returns the centroid geometry and the number of markers in that cluster.
-    Also applies category filtering if provided.
+    Also applies category and capture-time ('from'/'to') filtering if provided.
     """
     try:
-        minlat = float(request.args.get('minlat'))
-        minlon = float(request.args.get('minlon'))
-        maxlat = float(request.args.get('maxlat'))
-        maxlon = float(request.args.get('maxlon'))
+        minlat, minlon, maxlat, maxlon = parse_bbox(
+            request.args.get('minlat'), request.args.get('minlon'),
+            request.args.get('maxlat'), request.args.get('maxlon')
+        )
     except (TypeError, ValueError):
         return jsonify({"error": "Missing or invalid bounding box parameters."}), 400
 
@@ -122,23 +259,29 @@ def markers_clustered():
         cluster_distance = float(request.args.get('cluster_distance', 0.05))
     except ValueError:
         cluster_distance = 0.05
+    if not math.isfinite(cluster_distance):
+        cluster_distance = 0.05
 
-    categories_param = request.args.get('categories')
-    label_clause = ""
-    label_params = []
-    if categories_param:
-        cat_list = [cat.strip() for cat in categories_param.split(',') if cat.strip()]
-        if cat_list:
-            placeholders = ",".join(["%s"] * len(cat_list))
-            label_clause = f" AND label IN ({placeholders})"
-            label_params = cat_list
+    label_clause, label_params = category_filter()
+
+    try:
+        time_clause, time_params = time_range_filter()
+    except ValueError:
+        return jsonify({"error": "Invalid 'from'/'to' parameters, expected ISO 8601 dates."}), 400
+
+    snapshot = current_snapshot()
+    if snapshot is not None:
+        time_from, time_to = time_range_bounds(request.args.get('from'), request.args.get('to'))
+        label_ids = snapshot.label_ids(label_params) if label_clause else None
+        idx = snapshot.query(minlat, minlon, maxlat, maxlon, label_ids, time_from, time_to)
+        return jsonify(snapshot.clusters(idx, cluster_distance))
 
     envelope = f"ST_MakeEnvelope({minlon}, {minlat}, {maxlon}, {maxlat}, 4326)"
     query = f"""
     WITH filtered AS (
       SELECT geom
       FROM markers
-      WHERE geom && {envelope} {label_clause}
+      WHERE geom && {envelope} {label_clause} {time_clause}
     ),
     clusters AS (
       SELECT unnest(ST_ClusterWithin(geom, %s)) AS cluster
@@ -150,18 +293,235 @@ def markers_clustered():
     FROM clusters;
     """
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute(query, (*label_params, cluster_distance))
-        rows = cur.fetchall()
-        cur.close()
-        conn.close()
+        rows = fetch_all_shared(query, (*label_params, *time_params, cluster_distance), RealDictCursor)
         return jsonify(rows)
     except Exception as e:
         import traceback
         print("Error in /markers_clustered:", traceback.format_exc())
         return jsonify({"error": str(e)}), 500
 
+@app.route('/markers/nearest')
+def markers_nearest():
+    """
+    Returns the k markers nearest to (lat, lon), closest first, with their
+    distance in meters. Candidates are retrieved with the GiST index KNN
+    ordering (geom <-> point) and re-ranked by geodesic distance; the distance
+    of the k-th one then bounds an exact radius search.
+    Optional parameters: k (default 10), radius (meters), categories, from/to.
+    """
+    try:
+        lat = float(request.args.get('lat'))
+        lon = float(request.args.get('lon'))
+    except (TypeError, ValueError):
+        return jsonify({"error": "Missing or invalid 'lat'/'lon' parameters."}), 400
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return jsonify({"error": "'lat'/'lon' out of range."}), 400
+
+    try:
+        k = int(request.args.get('k', 10))
+        radius = request.args.get('radius')
+        radius = float(radius) if radius else None
+    except ValueError:
+        return jsonify({"error": "Invalid 'k' or 'radius' parameter."}), 400
+    if not 1 <= k <= MAX_NEAREST_K:
+        return jsonify({"error": f"'k' must be between 1 and {MAX_NEAREST_K}."}), 400
+    if radius is not None and not radius > 0:
+        return jsonify({"error": "'radius' must be a positive number of meters."}), 400
+
+    label_clause, label_params = category_filter()
+    try:
+        time_clause, time_params = time_range_filter()
+    except ValueError:
+        return jsonify({"error": "Invalid 'from'/'to' parameters, expected ISO 8601 dates."}), 400
+
+    point = f"ST_SetSRID(ST_MakePoint({lon}, {lat}), 4326)"
+
+    def nearest_query(radius, order):
+        radius_clause = ""
+        if radius is not None:
+            # The envelope (widened in longitude by 1/cos(lat)) lets the GiST
+            # index prune before the exact geodesic test.
+            dlat, dlon = degree_buffer(lat, radius)
+            envelope = f"ST_MakeEnvelope({lon - dlon}, {lat - dlat}, {lon + dlon}, {lat + dlat}, 4326)"
+            radius_clause = f" AND geom && {envelope} AND ST_DWithin(geom::geography, {point}::geography, {radius})"
+        return f"""
+        WITH candidates AS (
+          SELECT id, label, score, projection_path, detection_path, crop_path, depth_path,
+                 source_path, object_depth, captured_at, geom, bounding_box
+          FROM markers
+          WHERE TRUE {radius_clause} {label_clause} {time_clause}
+          {order}
+        )
+        SELECT id, label, score, projection_path, detection_path, crop_path, depth_path,
+               source_path, object_depth, captured_at,
+               ST_AsGeoJSON(geom) AS geom,
+               ST_AsGeoJSON(bounding_box) AS bounding_box,
+               ST_Distance(geom::geography, {point}::geography) AS distance_m
+        FROM candidates
+        ORDER BY distance_m, id
+        LIMIT %s;
+        """
+
+    try:
+        # First pass: KNN candidates re-ranked by geodesic distance.
+        rows = fetch_all_shared(
+            nearest_query(radius, f"ORDER BY geom <-> {point} LIMIT %s"),
+            (*label_params, *time_params, k * KNN_CANDIDATE_FACTOR, k), RealDictCursor
+        )
+        if len(rows) == k:
+            # k markers lie within the k-th candidate distance, so the true k
+            # nearest do too: an exact pass over that radius settles the ranking.
+            bound = rows[-1]['distance_m'] + 1e-3
+            if radius is not None:
+                bound = min(bound, radius)
+            rows = fetch_all_shared(nearest_query(bound, ""), (*label_params, *time_params, k), RealDictCursor)
+        return jsonify(rows)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/markers/along', methods=['GET', 'POST'])
+def markers_along():
+    """
+    Returns the markers within `buffer` meters of a route, ordered by their
+    position along it. The route is a GeoJSON LineString ('line') or an encoded
+    polyline ('polyline'), given as query parameters or in a JSON body for long
+    routes. Each marker carries its fraction along the route, the distance along
+    it and its offset from it, in meters.
+    Optional parameters, also accepted in the JSON body: buffer (meters,
+    default 20), categories (comma separated or a list), from/to.
+    """
+    body = request.get_json(silent=True) or {}
+    if not isinstance(body, dict):
+        return jsonify({"error": "The JSON body must be an object."}), 400
+    params = {**request.args.to_dict(), **body}
+    try:
+        coords = parse_route(params.get('line'), params.get('polyline'))
+        buffer_m = float(params.get('buffer', 20))
+    except (TypeError, ValueError, IndexError, KeyError):
+        return jsonify({"error": "Missing or invalid route or buffer parameters."}), 400
+    if not 0 < buffer_m <= MAX_CORRIDOR_BUFFER:
+        return jsonify({"error": f"'buffer' must be between 0 and {MAX_CORRIDOR_BUFFER} meters."}), 400
+    if route_piece_count(coords) > MAX_ROUTE_PIECES:
+        return jsonify({"error": "Route too long, split it into shorter routes."}), 400
+
+    # Filters may come from the JSON body too; categories there can be a list.
+    categories = params.get('categories')
+    if isinstance(categories, list):
+        categories = ",".join(str(c) for c in categories)
+    if categories is not None and not isinstance(categories, str):
+        return jsonify({"error": "Invalid 'categories' parameter."}), 400
+    label_clause, label_params = category_clause(categories)
+    try:
+        time_clause, time_params = time_range_clause(params.get('from'), params.get('to'))
+    except (TypeError, ValueError, AttributeError):
+        return jsonify({"error": "Invalid 'from'/'to' parameters, expected ISO 8601 dates."}), 400
+
+    # The route is cut into short pieces whose bboxes, expanded in degrees, let
+    # the GiST index prune candidates per piece: the bbox of a whole diagonal
+    # route would cover far more markers than its corridor. Candidates then get
+    # the exact geodesic ST_DWithin test. The expansion uses the latitude where
+    # degrees of longitude are shortest to stay conservative.
+    max_abs_lat = max(abs(lat) for _, lat in coords)
+    dlat, dlon = degree_buffer(max_abs_lat, buffer_m)
+    route_geojson = json.dumps({"type": "LineString", "coordinates": coords})
+
+    query = f"""
+    WITH route AS (
+      SELECT line, ST_Length(line::geography) AS length_m
+      FROM (SELECT ST_SetSRID(ST_GeomFromGeoJSON(%s), 4326) AS line) AS r
+    ),
+    pieces AS (
+      SELECT ST_MakeLine(ST_PointN(s.line, i), ST_PointN(s.line, i + 1)) AS piece
+      FROM (SELECT ST_Segmentize(line, %s) AS line FROM route) AS s,
+           generate_series(1, ST_NPoints(s.line) - 1) AS i
+    ),
+    candidates AS (
+      SELECT DISTINCT m.id
+      FROM pieces
+      JOIN markers m ON m.geom && ST_Expand(pieces.piece, %s, %s)
+      WHERE TRUE {label_clause} {time_clause}
+    ),
+    corridor AS (
+      SELECT m.id, m.label, m.score, m.projection_path, m.detection_path, m.crop_path,
+             m.depth_path, m.source_path, m.object_depth, m.captured_at, m.geom, m.bounding_box,
+             ST_LineLocatePoint(route.line, m.geom) AS position,
+             route.length_m,
+             ST_Distance(m.geom::geography, route.line::geography) AS offset_m
+      FROM route
+      CROSS JOIN candidates c
+      JOIN markers m ON m.id = c.id
+      WHERE ST_DWithin(m.geom::geography, route.line::geography, %s)
+    )
+    SELECT id, label, score, projection_path, detection_path, crop_path, depth_path,
+           source_path, object_depth, captured_at,
+           ST_AsGeoJSON(geom) AS geom,
+           ST_AsGeoJSON(bounding_box) AS bounding_box,
+           position,
+           position * length_m AS distance_along_m,
+           offset_m
+    FROM corridor
+    ORDER BY position, offset_m;
+    """
+    try:
+        rows = fetch_all_shared(
+            query,
+            (route_geojson, ROUTE_PIECE_DEGREES, dlon, dlat, *label_params, *time_params, buffer_m),
+            RealDictCursor
+        )
+        return jsonify(rows)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/export')
+def export():
+    """
+    Streams markers as CSV, GeoJSONSeq or FlatGeobuf (encoded feature by feature)
+    from a COPY ... TO STDOUT, without materializing rows in memory.
+    Optional parameters: format (csv, geojsonseq, fgb), gzip (1/true),
+    minlat/minlon/maxlat/maxlon, categories, from/to.
+    """
+    fmt = request.args.get('format', 'csv').lower()
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"error": f"Unknown format, expected one of {sorted(EXPORT_FORMATS)}."}), 400
+    compress = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+
+    bbox = None
+    bbox_args = [request.args.get(key) for key in ('minlat', 'minlon', 'maxlat', 'maxlon')]
+    if any(bbox_args):
+        try:
+            bbox = parse_bbox(*bbox_args)
+        except (TypeError, ValueError):
+            return jsonify({"error": "Missing or invalid bounding box parameters."}), 400
+
+    try:
+        conn = get_db_connection(readonly=True)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    try:
+        copy_sql = build_export_copy(
+            conn, fmt, bbox, request.args.get('categories'),
+            request.args.get('from'), request.args.get('to')
+        )
+    except ValueError:
+        conn.close()
+        return jsonify({"error": "Invalid 'from'/'to' parameters, expected ISO 8601 dates."}), 400
+
+    def generate():
+        try:
+            yield from iter_export(conn, copy_sql, fmt, compress)
+        finally:
+            conn.close()
+
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    filename = f"markers{extension}"
+    if compress:
+        mimetype, filename = 'application/gzip', filename + '.gz'
+    return Response(
+        generate(),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
 @app.route('/markers_sample')
 def markers_sample():
     """
@@ -171,13 +531,13 @@ def markers_sample():
     sample_query = """
     SELECT id, label, score, ST_AsText(geom) AS geom, ST_AsText(bounding_box) AS bounding_box,
            projection_path, detection_path, crop_path, depth_path,
-           source_path, gps_img_direction, object_depth, object_relative_angle 
+           source_path, gps_img_direction, object_depth, object_relative_angle, captured_at
     FROM markers
     ORDER BY id ASC
     LIMIT 10;
     """
     try:
-        conn = get_db_connection()
+        conn = get_db_connection(readonly=True)
         cur = conn.cursor(cursor_factory=RealDictCursor)
         cur.execute(sample_query)
         sample_rows = cur.fetchall()
@@ -187,6 +547,11 @@ def markers_sample():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/db_status')
+def db_status():
+    """Returns the routing state (health, replication lag, open connections) of each database node."""
+    return jsonify(db_router.status())
+
 @app.route('/image/<path:filename>')
 def serve_image(filename):
     container_name = AZURE_BLOB_NAME
@@ -0,0 +1,170 @@
+"""
+Per-category summaries and viewport facet counts, precomputed at ingest.
+
+For each generation of the markers table (see table_generations.py), ingest
+records:
+  - marker_category_summary: one row per label with its marker count, score
+    range, bounds and capture-time range.
+  - marker_category_cells: marker counts per label in the cells of a few
+    uniform lon/lat grids (FACET_CELL_SIZES, in degrees).
+
+/categories?bbox=... counts the markers of each label in a viewport by summing
+the cells of the finest grid that covers the viewport with at most
+FACET_MAX_CELLS cells, instead of counting raw rows. Viewports larger than that
+on the coarsest grid still use it: a whole-world viewport spans about 65,000 1°
+cells, of which only those holding markers have rows. Cells crossing the edge of
+the viewport are counted whole, so counts are approximate by at most one cell
+around the viewport, and get more precise as the map zooms in. A live
+generation without facet rows (loaded before they existed) is counted from the
+markers table instead.
+
+Rows are tied to their generation and removed with it (ON DELETE CASCADE on
+the registry), so a swap or a rollback switches the summaries along with the
+table.
+"""
+
+import math
+from psycopg2 import sql
+
+from marker_filters import bbox_clause
+
+# Grid cell sizes (degrees) from finest to coarsest.
+FACET_CELL_SIZES = (0.001, 0.01, 0.1, 1.0)
+# Largest number of cells a viewport facet query may sum on a grid before a
+# coarser one is used (the coarsest grid is used whatever the count).
+FACET_MAX_CELLS = 4096
+
+CREATE_FACET_TABLES_QUERY = """
+CREATE TABLE IF NOT EXISTS marker_category_summary (
+    generation TEXT NOT NULL REFERENCES marker_generations (generation) ON DELETE CASCADE,
+    label TEXT NOT NULL,
+    marker_count INTEGER NOT NULL,
+    min_score REAL,
+    max_score REAL,
+    min_lat DOUBLE PRECISION,
+    min_lon DOUBLE PRECISION,
+    max_lat DOUBLE PRECISION,
+    max_lon DOUBLE PRECISION,
+    first_captured_at TIMESTAMPTZ,
+    last_captured_at TIMESTAMPTZ,
+    PRIMARY KEY (generation, label)
+);
+CREATE TABLE IF NOT EXISTS marker_category_cells (
+    generation TEXT NOT NULL REFERENCES marker_generations (generation) ON DELETE CASCADE,
+    cell_size DOUBLE PRECISION NOT NULL,
+    cy INTEGER NOT NULL,
+    cx INTEGER NOT NULL,
+    label TEXT NOT NULL,
+    marker_count INTEGER NOT NULL,
+    PRIMARY KEY (generation, cell_size, cy, cx, label)
+);
+"""
+
+SUMMARY_INSERT_QUERY = """
+INSERT INTO marker_category_summary (
+    generation, label, marker_count, min_score, max_score,
+    min_lat, min_lon, max_lat, max_lon, first_captured_at, last_captured_at
+)
+SELECT %s, label, count(*), min(score), max(score),
+       min(ST_Y(geom)), min(ST_X(geom)), max(ST_Y(geom)), max(ST_X(geom)),
+       min(captured_at), max(captured_at)
+FROM {table}
+WHERE label IS NOT NULL
+GROUP BY label;
+"""
+
+CELLS_INSERT_QUERY = """
+INSERT INTO marker_category_cells (generation, cell_size, cy, cx, label, marker_count)
+SELECT %s, s.size, floor(ST_Y(m.geom) / s.size)::int, floor(ST_X(m.geom) / s.size)::int, m.label, count(*)
+FROM {table} m CROSS JOIN unnest(%s::double precision[]) AS s(size)
+WHERE m.label IS NOT NULL AND m.geom IS NOT NULL
+GROUP BY 1, 2, 3, 4, 5;
+"""
+
+LIVE_GENERATION = "(SELECT generation FROM marker_generations WHERE status = 'live')"
+
+CATEGORY_LABELS_QUERY = f"""
+SELECT label FROM marker_category_summary
+WHERE generation = {LIVE_GENERATION}
+ORDER BY label;
+"""
+
+CATEGORY_SUMMARY_QUERY = f"""
+SELECT label, marker_count, min_score, max_score,
+       min_lat, min_lon, max_lat, max_lon, first_captured_at, last_captured_at
+FROM marker_category_summary
+WHERE generation = {LIVE_GENERATION}
+ORDER BY label;
+"""
+
+# Viewport counts from the markers table, for databases without facet tables.
+CATEGORY_COUNTS_QUERY = """
+SELECT label, count(*)::int AS marker_count
+FROM markers
+WHERE label IS NOT NULL{bbox_filter}
+GROUP BY label
+ORDER BY label;
+"""
+
+# Viewport counts from the facet cells of the live generation, or from the
+# markers table when that generation has no facet rows.
+CATEGORY_FACETS_QUERY = f"""
+SELECT label, sum(marker_count)::int AS marker_count
+FROM marker_category_cells
+WHERE generation = {LIVE_GENERATION}
+  AND cell_size = %s AND cy BETWEEN %s AND %s AND cx BETWEEN %s AND %s
+GROUP BY label
+UNION ALL
+SELECT label, count(*)::int
+FROM markers
+WHERE NOT EXISTS (SELECT 1 FROM marker_category_summary WHERE generation = {LIVE_GENERATION})
+  AND label IS NOT NULL{{bbox_filter}}
+GROUP BY label
+ORDER BY label;
+"""
+
+
+def build_category_facets(conn, generation, table):
+    """
+    Compute the category summary and facet cells of a loaded generation from
+    its table. Returns the number of facet cell rows.
+    """
+    with conn.cursor() as cur:
+        cur.execute(CREATE_FACET_TABLES_QUERY)
+        cur.execute(sql.SQL(SUMMARY_INSERT_QUERY).format(table=sql.Identifier(table)), (generation,))
+        cur.execute(
+            sql.SQL(CELLS_INSERT_QUERY).format(table=sql.Identifier(table)),
+            (generation, list(FACET_CELL_SIZES))
+        )
+        cells = cur.rowcount
+        cur.execute("ANALYZE marker_category_summary;")
+        cur.execute("ANALYZE marker_category_cells;")
+    conn.commit()
+    return cells
+
+
+def facet_cells(bbox):
+    """
+    Pick the facet grid for a (minlat, minlon, maxlat, maxlon) viewport: the
+    finest with at most FACET_MAX_CELLS cells over it, else the coarsest.
+    Returns (cell_size, cy0, cy1, cx0, cx1), the cell ranges being inclusive.
+    """
+    minlat, minlon, maxlat, maxlon = bbox
+    for cell_size in FACET_CELL_SIZES:
+        cy0, cy1 = math.floor(minlat / cell_size), math.floor(maxlat / cell_size)
+        cx0, cx1 = math.floor(minlon / cell_size), math.floor(maxlon / cell_size)
+        if (cy1 - cy0 + 1) * (cx1 - cx0 + 1) <= FACET_MAX_CELLS:
+            break
+    return cell_size, cy0, cy1, cx0, cx1
+
+
+def category_facets_query(bbox):
+    """Build the per-label viewport count query. Returns (query, params)."""
+    bbox_filter, bbox_params = bbox_clause(bbox)
+    return CATEGORY_FACETS_QUERY.format(bbox_filter=bbox_filter), list(facet_cells(bbox)) + bbox_params
+
+
+def category_counts_query(bbox):
+    """Build the per-label viewport count query over the markers table. Returns (query, params)."""
+    bbox_filter, bbox_params = bbox_clause(bbox)
+    return CATEGORY_COUNTS_QUERY.format(bbox_filter=bbox_filter), bbox_params
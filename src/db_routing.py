@@ -0,0 +1,275 @@
+"""
+Routing of database connections between a primary and read replicas.
+
+Writes (and anything not explicitly read-only) go to the primary. Read-only
+work is sent to the healthy replica with the fewest connections currently
+handed out by this process. Counts are not shared between processes: with
+single-threaded workers (e.g. gunicorn sync workers) each process has at most
+one connection open, so this amounts to a random choice among healthy replicas.
+Replicas are health-checked every check interval by a background thread of each
+process, after a first check run synchronously before the process routes its
+first read: until then replicas are not used. A replica that cannot be
+reached, or whose replay lag exceeds the allowed maximum, is skipped until a
+later check succeeds.
+When no replica is usable, reads fall back to the primary, and run_readonly
+retries a query on the primary when it fails on a replica.
+
+Replicas are given as "host[:port]" entries, e.g.
+  DB_REPLICA_HOSTS=replica-1.example.com,replica-2.example.com:6432
+Any PostgreSQL server holding the markers table can act as a replica, so two
+local instances loaded with generate_db.py are enough to exercise the routing.
+"""
+
+import os
+import time
+import random
+import threading
+import psycopg2
+import psycopg2.extensions
+
+# Connection settings used when the DB_* environment variables are not set,
+# shared by the app and the scripts so that they all reach the same database.
+DB_DEFAULTS = {
+    "DB_NAME": "geodb",
+    "DB_USER": "postgres",
+    "DB_PASS": "",
+    "DB_HOST": "localhost",
+    "DB_PORT": "5432",
+}
+
+# Replay lag of a replica in seconds. It is 0 when the server is not a standby,
+# or when its WAL receiver is streaming and everything received has been replayed
+# (an idle primary sends nothing, so the last replay time alone would look stale).
+# Without a streaming WAL receiver the replica may be arbitrarily behind, so the
+# lag is the age of the last replayed transaction, and NULL (unhealthy) if none.
+REPLICA_LAG_QUERY = """
+SELECT CASE
+         WHEN NOT pg_is_in_recovery() THEN 0
+         WHEN EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming')
+              AND pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+         ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+       END;
+"""
+
+# Errors of a read on a replica after which it is retried on the primary:
+# lost connections, and recovery conflicts ("canceling statement due to
+# conflict with recovery"), which are transaction rollback errors.
+REPLICA_RETRY_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+
+def parse_hosts(value, default_port="5432"):
+    """Parse a comma separated 'host[:port]' list into (host, port) tuples."""
+    hosts = []
+    for entry in (value or "").split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        host, _, port = entry.partition(":")
+        hosts.append((host, port or default_port))
+    return hosts
+
+
+class DatabaseNode:
+    """A database server and the routing state this process keeps about it."""
+
+    def __init__(self, role, host, port):
+        self.role = role
+        self.host = host
+        self.port = port
+        self.in_flight = 0
+        # Replicas are only used once a health check has found them usable.
+        self.healthy = role == "primary"
+        self.lag = 0.0 if self.healthy else None
+        self.checked_at = None
+        self.error = None if self.healthy else "not checked yet"
+
+    def status(self):
+        return {
+            "role": self.role,
+            "host": self.host,
+            "port": self.port,
+            "healthy": self.healthy,
+            "lag_seconds": self.lag,
+            "in_flight": self.in_flight,
+            "error": self.error,
+        }
+
+
+class RoutedConnection(psycopg2.extensions.connection):
+    """Connection that gives its slot back to the node it was routed to once closed."""
+
+    router = None
+    node = None
+
+    def close(self):
+        self._release()
+        super().close()
+
+    def __del__(self):
+        self._release()
+
+    def _release(self):
+        if self.node is not None:
+            node, self.node = self.node, None
+            self.router.release(node)
+
+
+class DatabaseRouter:
+    """Hands out connections to the primary or to the healthy replica least used by this process."""
+
+    def __init__(self, dbname, user, password, primary, replicas=(),
+                 max_lag=30.0, check_interval=10.0, connect_timeout=3):
+        self.dbname = dbname
+        self.user = user
+        self.password = password
+        self.primary = DatabaseNode("primary", *primary)
+        self.replicas = [DatabaseNode("replica", host, port) for host, port in replicas]
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.connect_timeout = connect_timeout
+        self.lock = threading.Lock()
+        self.checker_pid = None
+
+    @classmethod
+    def from_env(cls):
+        """Build a router from the DB_* environment variables."""
+        port = os.getenv("DB_PORT", DB_DEFAULTS["DB_PORT"])
+        return cls(
+            dbname=os.getenv("DB_NAME", DB_DEFAULTS["DB_NAME"]),
+            user=os.getenv("DB_USER", DB_DEFAULTS["DB_USER"]),
+            password=os.getenv("DB_PASS", DB_DEFAULTS["DB_PASS"]),
+            primary=(os.getenv("DB_HOST", DB_DEFAULTS["DB_HOST"]), port),
+            replicas=parse_hosts(os.getenv("DB_REPLICA_HOSTS"), port),
+            max_lag=float(os.getenv("DB_REPLICA_MAX_LAG", "30")),
+            check_interval=float(os.getenv("DB_HEALTH_CHECK_INTERVAL", "10")),
+            connect_timeout=int(os.getenv("DB_CONNECT_TIMEOUT", "3")),
+        )
+
+    def _open(self, node):
+        conn = psycopg2.connect(
+            dbname=self.dbname,
+            user=self.user,
+            password=self.password,
+            host=node.host,
+            port=node.port,
+            connect_timeout=self.connect_timeout,
+            connection_factory=RoutedConnection
+        )
+        with self.lock:
+            node.in_flight += 1
+        conn.router = self
+        conn.node = node
+        return conn
+
+    def release(self, node):
+        with self.lock:
+            node.in_flight = max(node.in_flight - 1, 0)
+
+    def mark_unhealthy(self, node, error):
+        node.healthy = False
+        node.error = str(error)
+        node.checked_at = time.monotonic()
+
+    def check(self, node):
+        """Refresh the health and replay lag of a replica."""
+        try:
+            conn = psycopg2.connect(
+                dbname=self.dbname,
+                user=self.user,
+                password=self.password,
+                host=node.host,
+                port=node.port,
+                connect_timeout=self.connect_timeout
+            )
+            try:
+                cur = conn.cursor()
+                cur.execute(REPLICA_LAG_QUERY)
+                lag = cur.fetchone()[0]
+                cur.close()
+            finally:
+                conn.close()
+            if lag is None:
+                node.lag = None
+                node.healthy = False
+                node.error = "not streaming and no transaction replayed"
+            else:
+                node.lag = float(lag)
+                node.healthy = node.lag <= self.max_lag
+                node.error = None if node.healthy else f"replication lag {node.lag:.1f}s"
+        except Exception as e:
+            node.error = str(e)
+            node.healthy = False
+        node.checked_at = time.monotonic()
+
+    def check_all(self):
+        for node in self.replicas:
+            self.check(node)
+
+    def _check_loop(self):
+        while True:
+            time.sleep(self.check_interval)
+            self.check_all()
+
+    def _ensure_checker(self):
+        """
+        Start the background health check thread of this process. Threads do not
+        survive a fork, so forked workers each start their own on first use.
+        The replicas are checked once first, in the calling thread, so a replica
+        far behind never serves the first reads of a process; reads routed by
+        other threads meanwhile go to the primary.
+        """
+        pid = os.getpid()
+        if self.checker_pid == pid:
+            return
+        with self.lock:
+            if self.checker_pid == pid:
+                return
+            self.checker_pid = pid
+        self.check_all()
+        threading.Thread(target=self._check_loop, name="db-health-check", daemon=True).start()
+
+    def connect(self, readonly=False):
+        """
+        Open a connection for a request. Read-only requests go to the healthy
+        replica with the fewest connections open in this process and fall back
+        to the primary; everything else uses the primary.
+        """
+        if readonly and self.replicas:
+            self._ensure_checker()
+            with self.lock:
+                candidates = [node for node in self.replicas if node.healthy]
+                random.shuffle(candidates)
+                candidates.sort(key=lambda node: node.in_flight)
+            for node in candidates:
+                try:
+                    return self._open(node)
+                except psycopg2.OperationalError as e:
+                    self.mark_unhealthy(node, e)
+        return self._open(self.primary)
+
+    def run_readonly(self, fn):
+        """
+        Return fn(conn) for a read-only connection. If it fails on a replica with
+        a connection error or a recovery conflict, it is run again once on the
+        primary; a replica that lost its connection is marked unhealthy.
+        """
+        conn = self.connect(readonly=True)
+        node = conn.node
+        try:
+            return fn(conn)
+        except REPLICA_RETRY_ERRORS as e:
+            if node is self.primary:
+                raise
+            if not isinstance(e, psycopg2.extensions.TransactionRollbackError):
+                self.mark_unhealthy(node, e)
+        finally:
+            conn.close()
+        conn = self._open(self.primary)
+        try:
+            return fn(conn)
+        finally:
+            conn.close()
+
+    def status(self):
+        """Routing state of every node, for diagnostics."""
+        return [self.primary.status()] + [node.status() for node in self.replicas]
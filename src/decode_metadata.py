@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Vectorized decoding of detection metadata files for ingest.
+
+Metadata files are parsed with orjson when it is installed (falling back to the
+standard json module). All objects of a batch of files are gathered into NumPy
+arrays, so the DMS -> decimal conversion and the geometry encoding run as array
+operations instead of once per object.
+
+The capture time of each panorama (GPSDateStamp + GPSTimeStamp, UTC) is decoded
+the same way into a timestamp for the captured_at column.
+
+Geometries are returned either as EWKT strings ('SRID=4326;POINT(lon lat)', the
+historical format) or as hex-encoded EWKB, which PostGIS accepts directly as
+geometry input and which avoids formatting and re-parsing float text.
+"""
+
+import os
+import glob
+import json
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+SRID = 4326
+
+# Labels (normalized, lower case) that are never ingested.
+SKIPPED_LABELS = {"electricity management box"}
+
+# Columns of the markers table filled by a decoded record, in record order.
+MARKER_COLUMNS = (
+    "label", "score", "geom", "bounding_box", "projection_path", "detection_path",
+    "crop_path", "depth_path", "source_path", "gps_img_direction", "object_depth",
+    "object_relative_angle", "captured_at",
+)
+
+GEOM_FORMATS = ("wkt", "wkb")
+
+# Weights turning a (degrees, minutes, seconds) triple into decimal degrees.
+DMS_WEIGHTS = np.array([1.0, 1.0 / 60.0, 1.0 / 3600.0])
+
+# Little-endian EWKB layouts: byte order, geometry type (with the SRID flag), SRID, payload.
+EWKB_SRID_FLAG = 0x20000000
+EWKB_POINT = np.dtype([
+    ("order", "u1"), ("type", "<u4"), ("srid", "<u4"),
+    ("xy", "<f8", (2,)),
+])
+EWKB_POLYGON = np.dtype([
+    ("order", "u1"), ("type", "<u4"), ("srid", "<u4"),
+    ("rings", "<u4"), ("npoints", "<u4"), ("xy", "<f8", (5, 2)),
+])
+
+
+def parse_json(data):
+    """Parse JSON bytes, using orjson when available."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def find_metadata_files(metadata_dir):
+    """Return all *_metadata.json files under metadata_dir (recursively)."""
+    return glob.glob(os.path.join(metadata_dir, "**", "*_metadata.json"), recursive=True)
+
+
+def iter_file_batches(filepaths, batch_size):
+    """Yield successive lists of at most batch_size file paths."""
+    for start in range(0, len(filepaths), batch_size):
+        yield filepaths[start:start + batch_size]
+
+
+def convert_dms_to_decimal(dms, ref):
+    """
+    Convert a single DMS dictionary to a decimal degree value.
+    dms should be a dict with keys "degrees", "minutes", "seconds".
+    Scalar reference for dms_to_decimal.
+    """
+    degrees = float(dms.get("degrees", 0))
+    minutes = float(dms.get("minutes", 0))
+    seconds = float(dms.get("seconds", 0))
+    decimal = degrees + minutes / 60 + seconds / 3600
+    if ref in ['S', 'W']:
+        decimal = -decimal
+    return decimal
+
+
+def dms_to_decimal(dms, refs):
+    """
+    Convert an (n, 3) array of DMS triples and a sequence of n hemisphere
+    references to decimal degrees. Rows containing NaN stay NaN.
+    """
+    decimal = dms @ DMS_WEIGHTS
+    negative = np.isin(np.asarray(refs, dtype=object), ("S", "W"))
+    return np.where(negative, -decimal, decimal)
+
+
+def _to_float_array(rows, width):
+    """
+    Convert a list of row tuples to a float64 (n, width) array.
+    Rows holding values that cannot be parsed as floats are filled with NaN.
+    """
+    try:
+        return np.asarray(rows, dtype=np.float64).reshape(len(rows), width)
+    except (TypeError, ValueError):
+        out = np.full((len(rows), width), np.nan)
+        for i, row in enumerate(rows):
+            try:
+                out[i] = np.asarray(row, dtype=np.float64)
+            except (TypeError, ValueError):
+                pass
+        return out
+
+
+def _to_datetime_array(dates):
+    """
+    Convert a list of 'YYYY:MM:DD' GPS date stamps to a datetime64[D] array.
+    Missing or malformed dates become NaT.
+    """
+    iso = [d.replace(":", "-") if isinstance(d, str) else None for d in dates]
+    try:
+        return np.array(iso, dtype="datetime64[D]")
+    except ValueError:
+        out = np.full(len(iso), np.datetime64("NaT"), dtype="datetime64[D]")
+        for i, d in enumerate(iso):
+            try:
+                out[i] = np.datetime64(d, "D")
+            except ValueError:
+                pass
+        return out
+
+
+def capture_timestamps(dates, times):
+    """
+    Combine GPS date stamps and an (n, 3) array of hour/minute/second values into
+    UTC ISO 8601 strings. Entries with a missing date or time are None.
+    """
+    seconds = times @ np.array([3600.0, 60.0, 1.0])
+    valid = ~np.isnan(seconds)
+    millis = np.where(valid, np.round(seconds * 1000.0), 0).astype(np.int64)
+    stamps = _to_datetime_array(dates).astype("datetime64[ms]") + millis.astype("timedelta64[ms]")
+    valid &= ~np.isnat(stamps)
+    out = [None] * len(stamps)
+    idx = np.flatnonzero(valid)
+    for i, stamp in zip(idx.tolist(), np.datetime_as_string(stamps[idx], unit="ms", timezone="UTC").tolist()):
+        out[i] = stamp
+    return out
+
+
+def _dms_triple(dms):
+    return (dms.get("degrees", 0), dms.get("minutes", 0), dms.get("seconds", 0))
+
+
+def _time_triple(ts):
+    if not ts:
+        return (np.nan, np.nan, np.nan)
+    return (ts.get("hour"), ts.get("minute"), ts.get("second"))
+
+
+def _bbox_quad(bb):
+    if not bb:
+        return (np.nan, np.nan, np.nan, np.nan)
+    return (bb.get("xmin"), bb.get("ymin"), bb.get("xmax"), bb.get("ymax"))
+
+
+def bbox_rings(bboxes):
+    """Build closed polygon rings, shape (n, 5, 2), from an (n, 4) xmin/ymin/xmax/ymax array."""
+    xmin, ymin, xmax, ymax = bboxes.T
+    xs = np.stack([xmin, xmax, xmax, xmin, xmin], axis=1)
+    ys = np.stack([ymin, ymin, ymax, ymax, ymin], axis=1)
+    return np.stack([xs, ys], axis=2)
+
+
+def _ewkb_hex(dtype, geom_type, coords):
+    """Encode coordinate arrays as a list of hex EWKB strings, one per row."""
+    buf = np.zeros(len(coords), dtype=dtype)
+    buf["order"] = 1
+    buf["type"] = geom_type | EWKB_SRID_FLAG
+    buf["srid"] = SRID
+    if "rings" in dtype.names:
+        buf["rings"] = 1
+        buf["npoints"] = coords.shape[1]
+    buf["xy"] = coords
+    hexed = buf.tobytes().hex()
+    width = dtype.itemsize * 2
+    return [hexed[i:i + width] for i in range(0, len(hexed), width)]
+
+
+def encode_points(lon, lat, geom_format="wkt"):
+    """Encode point geometries as EWKT strings or hex EWKB."""
+    if geom_format == "wkb":
+        return _ewkb_hex(EWKB_POINT, 1, np.stack([lon, lat], axis=1))
+    return [f"SRID={SRID};POINT({x} {y})" for x, y in zip(lon.tolist(), lat.tolist())]
+
+
+def encode_polygons(rings, geom_format="wkt"):
+    """Encode (n, 5, 2) rings as EWKT strings or hex EWKB; rows containing NaN become None."""
+    valid = ~np.isnan(rings).any(axis=(1, 2))
+    out = [None] * len(rings)
+    if not valid.any():
+        return out
+    idx = np.flatnonzero(valid)
+    if geom_format == "wkb":
+        encoded = _ewkb_hex(EWKB_POLYGON, 3, rings[idx])
+    else:
+        encoded = [
+            f"SRID={SRID};POLYGON((" + ", ".join(f"{x} {y}" for x, y in ring) + "))"
+            for ring in rings[idx].tolist()
+        ]
+    for i, geom in zip(idx.tolist(), encoded):
+        out[i] = geom
+    return out
+
+
+def decode_metadata(metas, geom_format="wkt"):
+    """
+    Decode a batch of parsed metadata dictionaries into marker records.
+
+    Returns (records, skipped) where records is a list of tuples ordered as
+    MARKER_COLUMNS and skipped counts objects dropped because of an ignored
+    label or an unparseable location.
+    """
+    if geom_format not in GEOM_FORMATS:
+        raise ValueError(f"Unknown geometry format '{geom_format}', expected one of {GEOM_FORMATS}.")
+
+    objs, sources = [], []
+    dates, times = [], []
+    lat_dms, lon_dms, lat_refs, lon_refs, bboxes = [], [], [], [], []
+    skipped = 0
+    for meta in metas:
+        source = meta.get("source", {})
+        gps = source.get("GPS_metadata", {})
+        date_stamp = gps.get("GPSDateStamp")
+        time_stamp = _time_triple(gps.get("GPSTimeStamp"))
+        for obj in meta.get("objects", []):
+            label_str = " ".join(obj.get("label", "").split()).lower()
+            if label_str in SKIPPED_LABELS:
+                skipped += 1
+                continue
+            comp = obj.get("computed_location", {})
+            lat_dms.append(_dms_triple(comp.get("GPSLatitude", {})))
+            lon_dms.append(_dms_triple(comp.get("GPSLongitude", {})))
+            lat_refs.append(comp.get("GPSLatitudeRef", "N"))
+            lon_refs.append(comp.get("GPSLongitudeRef", "E"))
+            bboxes.append(_bbox_quad(obj.get("bounding_box")))
+            dates.append(date_stamp)
+            times.append(time_stamp)
+            objs.append(obj)
+            sources.append(source)
+
+    if not objs:
+        return [], skipped
+
+    lat = dms_to_decimal(_to_float_array(lat_dms, 3), lat_refs)
+    lon = dms_to_decimal(_to_float_array(lon_dms, 3), lon_refs)
+    located = ~(np.isnan(lat) | np.isnan(lon))
+    skipped += int(len(objs) - located.sum())
+
+    keep = np.flatnonzero(located)
+    points = encode_points(lon[keep], lat[keep], geom_format)
+    polygons = encode_polygons(bbox_rings(_to_float_array(bboxes, 4)[keep]), geom_format)
+    captured = capture_timestamps([dates[i] for i in keep.tolist()], _to_float_array(times, 3)[keep])
+
+    records = []
+    for i, point, polygon, captured_at in zip(keep.tolist(), points, polygons, captured):
+        obj, source = objs[i], sources[i]
+        records.append((
+            obj.get("label", "Unknown").strip(),
+            obj.get("score", 0.0),
+            point,
+            polygon,
+            obj.get("projection_path", ""),
+            obj.get("detection_path", obj.get("projection_path", "")),
+            obj.get("crop_path", ""),
+            obj.get("depth_path", ""),
+            source.get("path", ""),
+            source.get("GPSImgDirection", 0.0),
+            obj.get("depth", 0.0),
+            obj.get("relative_angle", 0.0),
+            captured_at,
+        ))
+    return records, skipped
+
+
+def read_metadata_files(filepaths):
+    """
+    Read and parse a batch of metadata files.
+    Returns (metas, failed_files, bytes_read).
+    """
+    metas, failed = [], []
+    bytes_read = 0
+    for filepath in filepaths:
+        try:
+            with open(filepath, "rb") as f:
+                data = f.read()
+            bytes_read += len(data)
+            metas.append(parse_json(data))
+        except Exception as e:
+            failed.append((filepath, e))
+    return metas, failed, bytes_read
+
+
+def decode_metadata_files(filepaths, geom_format="wkt"):
+    """
+    Parse and decode a batch of metadata files.
+    Returns (records, skipped, failed_files).
+    """
+    metas, failed, _ = read_metadata_files(filepaths)
+    records, skipped = decode_metadata(metas, geom_format)
+    return records, skipped, failed
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Bulk export of markers streamed straight from PostgreSQL with COPY ... TO STDOUT.
+
+Rows are never materialized in Python: COPY output is read in fixed-size chunks
+by a background thread and handed over through a bounded queue, optionally
+gzip-compressed on the fly, so memory stays constant whatever the row count.
+
+Supported formats:
+  - csv:        one row per marker (lat/lon columns, capture time, paths).
+  - geojsonseq: GeoJSON text sequence (RFC 8142): each feature is preceded by
+                an RS (0x1E) character and followed by a newline.
+  - fgb:        FlatGeobuf without spatial index, encoded feature by feature in
+                Python (fgb_writer.py) from COPY rows of point coordinates.
+
+Used by the /export route of app.py, and as a command line tool:
+  python src/export_markers.py --format csv --gzip -o markers.csv.gz \
+      [--bbox minlat,minlon,maxlat,maxlon] [--categories "utility pole,..."] \
+      [--from 2024-07-01] [--to 2024-07-31]
+"""
+
+import re
+import sys
+import zlib
+import queue
+import argparse
+import threading
+from dotenv import load_dotenv
+
+from marker_filters import bbox_clause, category_clause, time_range_clause, parse_bbox
+from db_routing import DatabaseRouter
+from fgb_writer import iter_flatgeobuf
+
+# Format name -> (mimetype, file extension).
+EXPORT_FORMATS = {
+    "csv": ("text/csv", ".csv"),
+    "geojsonseq": ("application/geo+json-seq", ".geojsons"),
+    "fgb": ("application/octet-stream", ".fgb"),
+}
+
+# Size of the chunks handed from the COPY thread to the consumer, and how many
+# of them may be buffered before COPY waits for the consumer.
+COPY_CHUNK_SIZE = 256 * 1024
+COPY_QUEUE_CHUNKS = 16
+
+EXPORT_QUERIES = {
+    "csv": """
+        SELECT id, label, score, ST_Y(geom) AS lat, ST_X(geom) AS lon, captured_at,
+               source_path, projection_path, detection_path, crop_path, depth_path,
+               object_depth, gps_img_direction, object_relative_angle
+        FROM markers
+        WHERE TRUE {filters}
+    """,
+    "geojsonseq": """
+        SELECT chr(30) || json_build_object(
+            'type', 'Feature',
+            'id', id,
+            'geometry', ST_AsGeoJSON(geom)::json,
+            'properties', json_build_object(
+                'label', label, 'score', score, 'captured_at', captured_at,
+                'source_path', source_path, 'projection_path', projection_path,
+                'depth_path', depth_path, 'object_depth', object_depth
+            )
+        )::text
+        FROM markers
+        WHERE TRUE {filters}
+    """,
+    "fgb": """
+        SELECT ST_X(geom), ST_Y(geom), id, label, score, to_json(captured_at) #>> '{{}}',
+               source_path, projection_path, depth_path, object_depth
+        FROM markers
+        WHERE geom IS NOT NULL {filters}
+    """,
+}
+
+# FlatGeobuf attribute columns, in the order of the "fgb" query after the coordinates.
+FGB_COLUMNS = [
+    ("id", "int"), ("label", "string"), ("score", "float"), ("captured_at", "datetime"),
+    ("source_path", "string"), ("projection_path", "string"), ("depth_path", "string"),
+    ("object_depth", "float"),
+]
+FGB_CONVERTERS = {"int": int, "float": float, "string": str, "datetime": str}
+
+# COPY options per format. GeoJSON lines are emitted through CSV mode with
+# control characters as quote/delimiter, so the JSON text is written verbatim
+# (text mode would double its backslashes). FlatGeobuf rows are read in text
+# format, where newlines inside values are escaped, so rows split on newlines.
+COPY_OPTIONS = {
+    "csv": "FORMAT csv, HEADER",
+    "geojsonseq": "FORMAT csv, QUOTE E'\\x01', DELIMITER E'\\x02'",
+    "fgb": "FORMAT text",
+}
+
+
+class _QueueWriter:
+    """File-like target for copy_expert that hands fixed-size chunks to a bounded queue."""
+
+    def __init__(self, chunk_queue, chunk_size):
+        self.queue = chunk_queue
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.queue.put(bytes(self.buffer))
+            self.buffer = bytearray()
+
+
+def build_export_copy(conn, fmt, bbox=None, categories=None, time_from=None, time_to=None):
+    """
+    Build the COPY ... TO STDOUT statement for an export.
+    bbox is a (minlat, minlon, maxlat, maxlon) tuple or None; categories is a comma
+    separated string; time_from/time_to are ISO 8601 bounds.
+    Raises ValueError for an unknown format or malformed time bounds.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format '{fmt}', expected one of {sorted(EXPORT_FORMATS)}.")
+    clauses, params = [], []
+    for clause, clause_params in (
+        bbox_clause(bbox),
+        category_clause(categories),
+        time_range_clause(time_from, time_to),
+    ):
+        clauses.append(clause)
+        params.extend(clause_params)
+    select = EXPORT_QUERIES[fmt].format(filters=" ".join(clauses))
+    # COPY does not accept bind parameters; psycopg2 interpolates them client side.
+    with conn.cursor() as cur:
+        select = cur.mogrify(select, params).decode()
+    return f"COPY ({select}) TO STDOUT WITH ({COPY_OPTIONS[fmt]})"
+
+
+def iter_copy(conn, copy_sql, chunk_size=COPY_CHUNK_SIZE):
+    """
+    Run a COPY ... TO STDOUT statement and yield its output as byte chunks.
+    If the consumer stops early, the running COPY is cancelled.
+    """
+    chunk_queue = queue.Queue(maxsize=COPY_QUEUE_CHUNKS)
+    done = object()
+    errors = []
+
+    def run_copy():
+        writer = _QueueWriter(chunk_queue, chunk_size)
+        try:
+            with conn.cursor() as cur:
+                cur.copy_expert(copy_sql, writer)
+            writer.flush()
+        except Exception as e:
+            errors.append(e)
+        finally:
+            chunk_queue.put(done)
+
+    thread = threading.Thread(target=run_copy, daemon=True)
+    thread.start()
+    finished = False
+    try:
+        while True:
+            chunk = chunk_queue.get()
+            if chunk is done:
+                finished = True
+                break
+            yield chunk
+    finally:
+        if not finished:
+            conn.cancel()
+            while chunk_queue.get() is not done:
+                pass
+        thread.join()
+    if errors:
+        raise errors[0]
+
+
+_TEXT_ESCAPES = {"b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t", "v": "\v"}
+_TEXT_ESCAPE_RE = re.compile(r"\\(.)")
+
+
+def _unescape_text(value):
+    if value == "\\N":
+        return None
+    if "\\" not in value:
+        return value
+    return _TEXT_ESCAPE_RE.sub(lambda m: _TEXT_ESCAPES.get(m.group(1), m.group(1)), value)
+
+
+def iter_copy_rows(chunks):
+    """Split COPY text format output into rows of values (None for NULL)."""
+    pending = b""
+    for chunk in chunks:
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            yield [_unescape_text(value) for value in line.decode().split("\t")]
+    if pending:
+        yield [_unescape_text(value) for value in pending.decode().split("\t")]
+
+
+def fgb_features(rows):
+    """Turn rows of the "fgb" query into (x, y, values) features for iter_flatgeobuf."""
+    converters = [FGB_CONVERTERS[column_type] for _, column_type in FGB_COLUMNS]
+    for row in rows:
+        values = [None if v is None else convert(v) for convert, v in zip(converters, row[2:])]
+        yield float(row[0]), float(row[1]), values
+
+
+def rechunk(chunks, chunk_size=COPY_CHUNK_SIZE):
+    """Group small byte chunks into chunks of about chunk_size bytes."""
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer += chunk
+        if len(buffer) >= chunk_size:
+            yield bytes(buffer)
+            buffer = bytearray()
+    if buffer:
+        yield bytes(buffer)
+
+
+def gzip_chunks(chunks, level=6):
+    """Gzip-compress a stream of byte chunks on the fly."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        out = compressor.compress(chunk)
+        if out:
+            yield out
+    yield compressor.flush()
+
+
+def iter_export(conn, copy_sql, fmt, compress=False):
+    """Yield the bytes of an export built by build_export_copy."""
+    chunks = iter_copy(conn, copy_sql)
+    if fmt == "fgb":
+        chunks = rechunk(iter_flatgeobuf("markers", FGB_COLUMNS, fgb_features(iter_copy_rows(chunks))))
+    if compress:
+        chunks = gzip_chunks(chunks)
+    return chunks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream markers out of the database with COPY.")
+    parser.add_argument("--format", choices=sorted(EXPORT_FORMATS), default="csv")
+    parser.add_argument("--bbox", help="minlat,minlon,maxlat,maxlon")
+    parser.add_argument("--categories", help="Comma separated list of labels.")
+    parser.add_argument("--from", dest="time_from", help="ISO 8601 lower capture-time bound.")
+    parser.add_argument("--to", dest="time_to", help="ISO 8601 upper capture-time bound (date-only includes the day).")
+    parser.add_argument("--gzip", action="store_true", help="Gzip the output on the fly.")
+    parser.add_argument("-o", "--output", help="Output file (default: stdout).")
+    args = parser.parse_args()
+
+    bbox = None
+    if args.bbox:
+        try:
+            bbox = parse_bbox(*args.bbox.split(","))
+        except (TypeError, ValueError):
+            parser.error("--bbox expects minlat,minlon,maxlat,maxlon")
+
+    load_dotenv()
+    # Exports are read-only: use a read replica when one is configured.
+    conn = DatabaseRouter.from_env().connect(readonly=True)
+    try:
+        try:
+            copy_sql = build_export_copy(conn, args.format, bbox, args.categories, args.time_from, args.time_to)
+        except ValueError as e:
+            parser.error(str(e))
+        out = open(args.output, "wb") if args.output else sys.stdout.buffer
+        try:
+            for chunk in iter_export(conn, copy_sql, args.format, args.gzip):
+                out.write(chunk)
+        finally:
+            if args.output:
+                out.close()
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+"""
+Streaming FlatGeobuf writer for point features.
+
+FlatGeobuf (https://flatgeobuf.org) is a magic number, a size-prefixed
+FlatBuffers header, an optional packed R-tree, then size-prefixed FlatBuffers
+features. Written without the R-tree and with an unknown feature count (0), the
+file is a plain sequence of independent records, so it can be produced one
+feature at a time with constant memory.
+
+The few FlatBuffers tables involved (Header, Column, Crs, Feature, Geometry)
+are encoded by the small _FlatBuffer builder below, which lays objects out front
+to back: each table is preceded by its vtable and followed by its children.
+"""
+
+import struct
+
+MAGIC = b"fgb\x03fgb\x01"
+
+# GeometryType and ColumnType enums of the FlatGeobuf schema.
+GEOMETRY_POINT = 1
+COLUMN_TYPES = {
+    "int": 5, "long": 7, "float": 9, "double": 10, "string": 11, "datetime": 13,
+}
+
+# Field ids of the schema tables.
+HEADER_NAME, HEADER_GEOMETRY_TYPE, HEADER_COLUMNS, HEADER_FEATURES_COUNT, HEADER_INDEX_NODE_SIZE, HEADER_CRS = 0, 2, 7, 8, 9, 10
+COLUMN_NAME, COLUMN_TYPE = 0, 1
+CRS_ORG, CRS_CODE = 0, 1
+FEATURE_GEOMETRY, FEATURE_PROPERTIES = 0, 1
+GEOMETRY_XY = 1
+
+# Struct formats and sizes of scalar table fields and of property values.
+_SCALARS = {"B": 1, "H": 2, "i": 4, "I": 4, "Q": 8, "q": 8, "d": 8}
+_PROPERTY_FORMATS = {5: "<i", 7: "<q", 9: "<f", 10: "<d"}
+
+
+class _FlatBuffer:
+    """Minimal FlatBuffers encoder: tables of scalars and offsets, vectors and strings."""
+
+    def __init__(self):
+        self.buf = bytearray(4)  # root table offset, patched by finish()
+
+    def _pad(self, alignment, extra=0):
+        """Pad so that the position after `extra` more bytes is aligned."""
+        self.buf += b"\0" * (-(len(self.buf) + extra) % alignment)
+
+    def _patch_offset(self, slot, target):
+        struct.pack_into("<I", self.buf, slot, target - slot)
+
+    def table(self, fields):
+        """
+        Write a table. fields maps field ids to (format, value) scalars, or to
+        ("offset", None) for references to children written later.
+        Returns (table position, {field id: position of its offset slot}).
+        """
+        layout = sorted(fields.items(), key=lambda item: -_SCALARS.get(item[1][0], 4))
+        offsets, size = {}, 4
+        for field_id, (fmt, _) in layout:
+            width = _SCALARS.get(fmt, 4)
+            size += -size % width if width < 8 else -(size - 4) % 8
+            offsets[field_id] = size
+            size += width
+        nfields = max(fields) + 1 if fields else 0
+        vtable = struct.pack(f"<HH{nfields}H", 4 + 2 * nfields, size, *[offsets.get(i, 0) for i in range(nfields)])
+
+        self._pad(2)
+        vtable_pos = len(self.buf)
+        self.buf += vtable
+        # The table starts 4 bytes before an 8-byte boundary, where its 8-byte fields begin.
+        self._pad(8, 4)
+        table_pos = len(self.buf)
+        self.buf += bytes(size)
+        struct.pack_into("<i", self.buf, table_pos, table_pos - vtable_pos)
+        slots = {}
+        for field_id, (fmt, value) in fields.items():
+            if fmt == "offset":
+                slots[field_id] = table_pos + offsets[field_id]
+            else:
+                struct.pack_into("<" + fmt, self.buf, table_pos + offsets[field_id], value)
+        return table_pos, slots
+
+    def vector(self, slot, fmt, values):
+        """Write a vector of scalars referenced from `slot`."""
+        width = _SCALARS[fmt]
+        self._pad(max(width, 4), 4)
+        self._patch_offset(slot, len(self.buf))
+        self.buf += struct.pack(f"<I{len(values)}{fmt}", len(values), *values)
+
+    def bytes_vector(self, slot, data):
+        self._pad(4)
+        self._patch_offset(slot, len(self.buf))
+        self.buf += struct.pack("<I", len(data)) + data
+
+    def string(self, slot, text):
+        data = text.encode()
+        self._pad(4)
+        self._patch_offset(slot, len(self.buf))
+        self.buf += struct.pack("<I", len(data)) + data + b"\0"
+
+    def offset_vector(self, slot, count):
+        """Write a vector of `count` offsets; returns the positions of their slots."""
+        self._pad(4)
+        self._patch_offset(slot, len(self.buf))
+        self.buf += struct.pack("<I", count) + bytes(4 * count)
+        start = len(self.buf) - 4 * count
+        return [start + 4 * i for i in range(count)]
+
+    def link(self, slot, target):
+        self._patch_offset(slot, target)
+
+    def finish(self, root):
+        struct.pack_into("<I", self.buf, 0, root)
+        self._pad(4)
+        return struct.pack("<I", len(self.buf)) + bytes(self.buf)
+
+
+def encode_header(name, columns, srid=4326):
+    """Size-prefixed Header for point features with (name, type) columns, without index."""
+    fb = _FlatBuffer()
+    header, slots = fb.table({
+        HEADER_NAME: ("offset", None),
+        HEADER_GEOMETRY_TYPE: ("B", GEOMETRY_POINT),
+        HEADER_COLUMNS: ("offset", None),
+        HEADER_FEATURES_COUNT: ("Q", 0),  # unknown
+        HEADER_INDEX_NODE_SIZE: ("H", 0),  # no spatial index
+        HEADER_CRS: ("offset", None),
+    })
+    fb.string(slots[HEADER_NAME], name)
+    column_slots = fb.offset_vector(slots[HEADER_COLUMNS], len(columns))
+    for column_slot, (column_name, column_type) in zip(column_slots, columns):
+        column, slots_c = fb.table({COLUMN_NAME: ("offset", None), COLUMN_TYPE: ("B", COLUMN_TYPES[column_type])})
+        fb.link(column_slot, column)
+        fb.string(slots_c[COLUMN_NAME], column_name)
+    crs, slots_crs = fb.table({CRS_ORG: ("offset", None), CRS_CODE: ("i", srid)})
+    fb.link(slots[HEADER_CRS], crs)
+    fb.string(slots_crs[CRS_ORG], "EPSG")
+    return fb.finish(header)
+
+
+def encode_properties(columns, values):
+    """Encode property values (None for missing) in FlatGeobuf's column-index/value layout."""
+    out = bytearray()
+    for i, ((_, column_type), value) in enumerate(zip(columns, values)):
+        if value is None:
+            continue
+        type_id = COLUMN_TYPES[column_type]
+        out += struct.pack("<H", i)
+        if type_id in _PROPERTY_FORMATS:
+            out += struct.pack(_PROPERTY_FORMATS[type_id], value)
+        else:
+            data = value.encode()
+            out += struct.pack("<I", len(data)) + data
+    return bytes(out)
+
+
+def _build_point_feature(x, y, properties):
+    fb = _FlatBuffer()
+    fields = {FEATURE_GEOMETRY: ("offset", None)}
+    if properties:
+        fields[FEATURE_PROPERTIES] = ("offset", None)
+    feature, slots = fb.table(fields)
+    geometry, geometry_slots = fb.table({GEOMETRY_XY: ("offset", None)})
+    fb.link(slots[FEATURE_GEOMETRY], geometry)
+    fb.vector(geometry_slots[GEOMETRY_XY], "d", (x, y))
+    if properties:
+        fb.bytes_vector(slots[FEATURE_PROPERTIES], properties)
+    return fb.finish(feature)
+
+
+def _point_feature_template():
+    """
+    Point features only differ by their coordinates and their properties vector,
+    which comes last: build one with marker values and locate both, so features
+    are encoded by patching bytes instead of running the builder each time.
+    """
+    marker = 1.5e300
+    data = _build_point_feature(marker, -marker, b"\xab")[4:]
+    xy_pos = data.find(struct.pack("<2d", marker, -marker))
+    properties_pos = len(data) - 8
+    if xy_pos < 0 or data[properties_pos:properties_pos + 5] != b"\x01\0\0\0\xab":
+        raise RuntimeError("Unexpected layout of the FlatGeobuf point feature template.")
+    return data[:properties_pos], xy_pos
+
+
+_POINT_PREFIX, _POINT_XY_POS = _point_feature_template()
+
+
+def encode_point_feature(x, y, properties):
+    """Size-prefixed Feature with a point geometry and encoded (non-empty) properties."""
+    if not properties:
+        return _build_point_feature(x, y, properties)
+    prefix = bytearray(_POINT_PREFIX)
+    struct.pack_into("<2d", prefix, _POINT_XY_POS, x, y)
+    padding = b"\0" * (-len(properties) % 4)
+    size = len(prefix) + 4 + len(properties) + len(padding)
+    return b"".join((struct.pack("<I", size), prefix, struct.pack("<I", len(properties)), properties, padding))
+
+
+def iter_flatgeobuf(name, columns, features):
+    """
+    Yield the bytes of a FlatGeobuf file of point features.
+    columns is a list of (name, type) pairs with types from COLUMN_TYPES;
+    features yields (x, y, values) with one value (or None) per column.
+    """
+    yield MAGIC + encode_header(name, columns)
+    for x, y, values in features:
+        yield encode_point_feature(x, y, encode_properties(columns, values))
@@ -21,6 +21,10 @@ For each file with at least one kept object:
        - The filtered objects.
   - The projection images and cropped depth images referenced by each kept object are copied.
   - The source image is resized to 1000px wide and copied.
+
+Set INGEST_PROFILE (and optionally INGEST_PROFILE_CPROFILE) to write a per-stage
+profile report of the run, and INGEST_LOG_LEVEL=DEBUG to log every written and
+copied file (see ingest_profile.py).
 """
 
 import os
@@ -30,6 +34,8 @@ import shutil
 from tqdm import tqdm
 from PIL import Image
 
+from ingest_profile import IngestProfiler, setup_logging
+
 # Set source and destination directories.
 METADATA_DIR = "/media/adrien/Space/Datasets/Overhead/processed/"
 KEEP_METADATA_DIR = "/media/adrien/Space/Datasets/Overhead/filtered/"
@@ -44,6 +50,9 @@ LABELS_OF_INTEREST = {
 # For source images, they are originally in:
 RAW_DIR = "/media/adrien/Space/Datasets/Overhead/raw/"
 
+log = setup_logging("filter_metadata")
+profiler = IngestProfiler.from_env("filter_metadata")
+
 def ensure_dir(path):
     """Ensure directory exists."""
     if not os.path.exists(path):
@@ -67,33 +76,51 @@ def make_relative_path(full_path, base_dir):
 def resize_image(src_path, dst_path, width=1000):
     """Resize image from src_path to a width of 1000 pixels (maintaining aspect ratio) and save to dst_path."""
     try:
-        img = Image.open(src_path)
-        w_percent = (width / float(img.size[0]))
-        height = int((float(img.size[1]) * float(w_percent)))
-        img = img.resize((width, height), Image.ANTIALIAS)
-        ensure_dir(os.path.dirname(dst_path))
-        img.save(dst_path)
-        print(f"[INFO] Resized and saved source image to {dst_path}")
+        with profiler.stage("resize") as stage:
+            img = Image.open(src_path)
+            w_percent = (width / float(img.size[0]))
+            height = int((float(img.size[1]) * float(w_percent)))
+            img = img.resize((width, height), Image.ANTIALIAS)
+            ensure_dir(os.path.dirname(dst_path))
+            img.save(dst_path)
+            stage.add(items=1)
+            if profiler.enabled:
+                stage.add(bytes_read=os.path.getsize(src_path), bytes_written=os.path.getsize(dst_path))
+        log.debug("Resized and saved source image to %s", dst_path)
     except Exception as e:
-        print(f"[ERROR] Resizing image {src_path} to {dst_path}: {e}")
+        log.error("Resizing image %s to %s: %s", src_path, dst_path, e)
+
+def copy_file(src_path, dst_path):
+    """Copy a file with its metadata, counted in the 'copy' profiling stage."""
+    with profiler.stage("copy") as stage:
+        shutil.copy2(src_path, dst_path)
+        stage.add(items=1)
+        if profiler.enabled:
+            size = os.path.getsize(dst_path)
+            stage.add(bytes_read=size, bytes_written=size)
 
 def process_metadata_file(filepath):
     """Process a single metadata JSON file; return True if a filtered file is written."""
     try:
-        with open(filepath, "r") as f:
-            meta = json.load(f)
+        with profiler.stage("read") as stage:
+            with open(filepath, "rb") as f:
+                data = f.read()
+            meta = json.loads(data)
+            stage.add(items=1, bytes_read=len(data))
     except Exception as e:
-        print(f"[ERROR] Reading {filepath}: {e}")
+        log.error("Reading %s: %s", filepath, e)
         return False
 
     # Filter objects based on label.
-    objects = meta.get("objects", [])
-    filtered_objects = []
-    for obj in objects:
-        label = obj.get("label", "").strip().lower()
-        if label in LABELS_OF_INTEREST:
-            filtered_objects.append(obj)
-    
+    with profiler.stage("filter") as stage:
+        objects = meta.get("objects", [])
+        filtered_objects = []
+        for obj in objects:
+            label = obj.get("label", "").strip().lower()
+            if label in LABELS_OF_INTEREST:
+                filtered_objects.append(obj)
+        stage.add(items=len(objects))
+
     if not filtered_objects:
         return False
 
@@ -113,11 +140,14 @@ def process_metadata_file(filepath):
     new_filepath = os.path.join(KEEP_METADATA_DIR, rel_path)
     ensure_dir(os.path.dirname(new_filepath))
     try:
-        with open(new_filepath, "w") as f:
-            json.dump(new_meta, f, indent=4)
-        print(f"[INFO] Wrote filtered metadata to {new_filepath}")
+        with profiler.stage("write") as stage:
+            data = json.dumps(new_meta, indent=4)
+            with open(new_filepath, "w") as f:
+                f.write(data)
+            stage.add(items=1, bytes_written=len(data))
+        log.debug("Wrote filtered metadata to %s", new_filepath)
     except Exception as e:
-        print(f"[ERROR] Writing {new_filepath}: {e}")
+        log.error("Writing %s: %s", new_filepath, e)
         return False
 
     # Copy associated files:
@@ -132,10 +162,10 @@ def process_metadata_file(filepath):
             dst_proj = os.path.join(KEEP_METADATA_DIR, proj_path)
             ensure_dir(os.path.dirname(dst_proj))
             try:
-                shutil.copy2(src_proj, dst_proj)
-                print(f"[INFO] Copied projection image to {dst_proj}")
+                copy_file(src_proj, dst_proj)
+                log.debug("Copied projection image to %s", dst_proj)
             except Exception as e:
-                print(f"[ERROR] Copying projection image from {src_proj} to {dst_proj}: {e}")
+                log.error("Copying projection image from %s to %s: %s", src_proj, dst_proj, e)
         # Depth image: similarly, from obj["depth_path"]
         depth_path = obj.get("depth_path")
         if depth_path:
@@ -143,10 +173,10 @@ def process_metadata_file(filepath):
             dst_depth = os.path.join(KEEP_METADATA_DIR, depth_path)
             ensure_dir(os.path.dirname(dst_depth))
             try:
-                shutil.copy2(src_depth, dst_depth)
-                print(f"[INFO] Copied depth image for object {i} to {dst_depth}")
+                copy_file(src_depth, dst_depth)
+                log.debug("Copied depth image for object %d to %s", i, dst_depth)
             except Exception as e:
-                print(f"[ERROR] Copying depth image from {src_depth} to {dst_depth}: {e}")
+                log.error("Copying depth image from %s to %s: %s", src_depth, dst_depth, e)
 
     # 2. For the source image, resize and copy.
     if "path" in source:
@@ -161,10 +191,13 @@ def process_metadata_file(filepath):
     return True
 
 def main():
-    metadata_files = glob.glob(os.path.join(METADATA_DIR, "**", "*_metadata.json"), recursive=True)
+    profiler.start()
+    with profiler.stage("glob") as stage:
+        metadata_files = glob.glob(os.path.join(METADATA_DIR, "**", "*_metadata.json"), recursive=True)
+        stage.add(items=len(metadata_files))
     total_files = len(metadata_files)
-    print(f"[INFO] Found {total_files} metadata files in {METADATA_DIR}")
-    
+    log.info("Found %d metadata files in %s", total_files, METADATA_DIR)
+
     processed_count = 0
     kept_count = 0
     for filepath in tqdm(metadata_files, desc="Processing files"):
@@ -172,7 +205,8 @@ def main():
         if process_metadata_file(filepath):
             kept_count += 1
     
-    print(f"[INFO] Processed {processed_count} files. Filtered metadata written for {kept_count} files.")
+    log.info("Processed %d files. Filtered metadata written for %d files.", processed_count, kept_count)
+    profiler.finish(log, processed=processed_count, kept=kept_count)
 
 if __name__ == '__main__':
     main()
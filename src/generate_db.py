@@ -1,130 +1,67 @@
 #!/usr/bin/env python3
 """
-This script resets the markers table on your Azure managed PostgreSQL server.
+This script reloads the markers table on your Azure managed PostgreSQL server.
 It loads configuration from a .env file, connects to the remote DB,
-enables the PostGIS extension, drops the existing 'markers' table (if any),
-creates a new 'markers' table with GIS columns (including new columns for additional metadata),
-and then processes JSON metadata files to insert marker records into the table.
+enables the PostGIS extension, creates a new generation table with GIS columns
+(including new columns for additional metadata), processes JSON metadata files to
+insert marker records into it, builds its indexes and statistics, and then swaps it
+in as 'markers' in one short transaction. The previous generation is kept for
+rollback (see table_generations.py); older ones are dropped.
+
+Set INGEST_PROFILE (and optionally INGEST_PROFILE_CPROFILE) to write a per-stage
+profile report of the run, and INGEST_LOG_LEVEL=DEBUG for detailed output
+(see ingest_profile.py).
 """
 
 import os
-import json
-import glob
+import logging
 import psycopg2
+from psycopg2 import sql
 from psycopg2.extras import execute_values, RealDictCursor
 from dotenv import load_dotenv
 
+from db_routing import DB_DEFAULTS
+from decode_metadata import GEOM_FORMATS, MARKER_COLUMNS, find_metadata_files, iter_file_batches, read_metadata_files, decode_metadata
+from ingest_profile import IngestProfiler, setup_logging
+from marker_snapshot import publish_snapshot
+from category_facets import build_category_facets
+from table_generations import (
+    ensure_registry, new_generation, generation_table, load_queries, register_loading, finish_loading,
+    swap_in, drop_generation, garbage_collect
+)
+
 # Load environment variables from the .env file
 load_dotenv()
 
+log = setup_logging("generate_db")
+profiler = IngestProfiler.from_env("generate_db")
+profiler.start()
+
 # Retrieve connection details from environment variables
-DB_NAME = os.environ.get("DB_NAME", "postgres")
-DB_USER = os.environ.get("DB_USER", "postgres")
-DB_PASS = os.environ.get("DB_PASS", "")
-DB_HOST = os.environ.get("DB_HOST", "localhost")
-DB_PORT = os.environ.get("DB_PORT", "5432")
+DB_NAME = os.environ.get("DB_NAME", DB_DEFAULTS["DB_NAME"])
+DB_USER = os.environ.get("DB_USER", DB_DEFAULTS["DB_USER"])
+DB_PASS = os.environ.get("DB_PASS", DB_DEFAULTS["DB_PASS"])
+DB_HOST = os.environ.get("DB_HOST", DB_DEFAULTS["DB_HOST"])
+DB_PORT = os.environ.get("DB_PORT", DB_DEFAULTS["DB_PORT"])
 METADATA_DIR = os.environ.get("KEEP_METADATA_DIR", "./metadata")
-print(f"[DEBUG] Using metadata directory: {METADATA_DIR}")
-
-def convert_dms_to_decimal(dms, ref):
-    """
-    Convert a DMS dictionary to a decimal degree value.
-    dms should be a dict with keys "degrees", "minutes", "seconds".
-    """
-    try:
-        degrees = float(dms.get("degrees", 0))
-        minutes = float(dms.get("minutes", 0))
-        seconds = float(dms.get("seconds", 0))
-    except Exception as e:
-        print(f"[DEBUG] Error converting DMS values: {e}")
-        raise e
-    decimal = degrees + minutes / 60 + seconds / 3600
-    if ref in ['S', 'W']:
-        decimal = -decimal
-    print(f"[DEBUG] Converted DMS {dms} with ref '{ref}' to decimal: {decimal}")
-    return decimal
-
-def load_markers_from_metadata(metadata_dir):
-    """
-    Scans through all JSON metadata files in metadata_dir (and subdirectories)
-    and builds a list of marker dictionaries. Computes decimal latitude/longitude 
-    and extracts bounding box information.
-    
-    NEW:
-    - For each object, copies meta["source"] (if any) into obj["source"].
-    - Skips any object whose label (after split) equals "electricity management box".
-    """
-    markers = []
-    metadata_files = glob.glob(os.path.join(metadata_dir, "**", "*_metadata.json"), recursive=True)
-    print(f"[DEBUG] Found {len(metadata_files)} metadata files in {metadata_dir}.")
-
-    for filepath in metadata_files:
-        print(f"[DEBUG] Processing file: {filepath}")
-        try:
-            with open(filepath, "r") as f:
-                meta = json.load(f)
-        except Exception as e:
-            print(f"[DEBUG] Error reading {filepath}: {e}")
-            continue
-
-        # Get the projection source info from meta (if any)
-        source_info = meta.get("source", {})
-        
-        # Process each detected object in the metadata file.
-        for obj in meta.get("objects", []):
-            # Normalize the label and filter out "electricity management box"
-            label_str = " ".join(obj.get("label", "").split()).lower()
-            if label_str == "electricity management box":
-                print(f"[DEBUG] Skipping object with label 'electricity management box' in {filepath}.")
-                continue
-
-            # Add the source info from meta into the object.
-            obj["source"] = source_info
+log.info("Using metadata directory: %s", METADATA_DIR)
 
-            comp = obj.get("computed_location", {})
-            lat_dms = comp.get("GPSLatitude", {})
-            lon_dms = comp.get("GPSLongitude", {})
-            lat_ref = comp.get("GPSLatitudeRef", "N")
-            lon_ref = comp.get("GPSLongitudeRef", "E")
-            
-            try:
-                decimal_lat = convert_dms_to_decimal(lat_dms, lat_ref)
-                decimal_lon = convert_dms_to_decimal(lon_dms, lon_ref)
-            except Exception as e:
-                print(f"[DEBUG] Error converting DMS to decimal in {filepath}: {e}")
-                continue
-            
-            # Update computed_location with decimal values.
-            obj.setdefault("computed_location", {})["decimal_lat"] = decimal_lat
-            obj["computed_location"]["decimal_lon"] = decimal_lon
-            print(f"[DEBUG] Updated computed_location with decimals: lat={decimal_lat}, lon={decimal_lon}")
-
-            # Extract bounding box information from the key "bounding_box".
-            bb = obj.get("bounding_box")
-            if bb:
-                try:
-                    xmin = float(bb.get("xmin"))
-                    ymin = float(bb.get("ymin"))
-                    xmax = float(bb.get("xmax"))
-                    ymax = float(bb.get("ymax"))
-                    # Create a WKT polygon for the bounding box.
-                    bbox_wkt = f'POLYGON(({xmin} {ymin}, {xmax} {ymin}, {xmax} {ymax}, {xmin} {ymax}, {xmin} {ymin}))'
-                    obj["bbox_wkt"] = bbox_wkt
-                    print(f"[DEBUG] Processed bounding_box for marker: {bbox_wkt}")
-                except Exception as e:
-                    print(f"[DEBUG] Error processing bounding_box in {filepath}: {e}")
-                    obj["bbox_wkt"] = None
-            else:
-                obj["bbox_wkt"] = None
-                print(f"[DEBUG] No bounding_box found for marker in {filepath}.")
-            
-            markers.append(obj)
-    
-    return markers
+# Geometry encoding used for the INSERT: "wkt" (EWKT strings) or "wkb" (hex EWKB).
+GEOM_FORMAT = os.environ.get("INGEST_GEOM_FORMAT", "wkt").lower()
+if GEOM_FORMAT not in GEOM_FORMATS:
+    # Checked before any generation is registered, so a typo leaves no table behind.
+    log.error("Invalid INGEST_GEOM_FORMAT '%s', expected one of: %s.", GEOM_FORMAT, ", ".join(GEOM_FORMATS))
+    exit(1)
+# Number of metadata files decoded together as one vectorized batch.
+BATCH_FILES = int(os.environ.get("INGEST_BATCH_FILES", "500"))
+# When set, a new in-memory serving snapshot is published there after the load.
+MARKER_SNAPSHOT_DIR = os.environ.get("MARKER_SNAPSHOT_DIR")
 
-# Load markers from metadata files
-markers = load_markers_from_metadata(METADATA_DIR)
-print(f"[DEBUG] Loaded {len(markers)} markers from metadata.")
+# Sorted so that the load order (and the ids of markers captured at the same time) is reproducible.
+with profiler.stage("glob") as stage:
+    metadata_files = sorted(find_metadata_files(METADATA_DIR))
+    stage.add(items=len(metadata_files))
+log.info("Found %d metadata files in %s.", len(metadata_files), METADATA_DIR)
 
 # Connect to the remote Azure managed PostgreSQL database
 try:
@@ -136,158 +73,189 @@ try:
         port=DB_PORT
     )
     cur = conn.cursor()
-    print("[DEBUG] Successfully connected to the database.")
+    log.info("Successfully connected to the database.")
 except Exception as e:
-    print("[DEBUG] Error connecting to the database:", e)
+    log.error("Error connecting to the database: %s", e)
     exit(1)
 
 # Enable the PostGIS extension (if not already enabled)
 try:
     cur.execute("CREATE EXTENSION IF NOT EXISTS postgis;")
     conn.commit()
-    print("[DEBUG] PostGIS extension enabled.")
+    log.info("PostGIS extension enabled.")
 except Exception as e:
-    print("[DEBUG] Error enabling PostGIS extension:", e)
+    log.error("Error enabling PostGIS extension: %s", e)
     conn.rollback()
 
-# Drop the existing markers table if it exists
-drop_table_query = "DROP TABLE IF EXISTS markers;"
-print("[DEBUG] Dropping table 'markers' if it exists...")
-cur.execute(drop_table_query)
-conn.commit()
-
-# Create the markers table with GIS columns and additional metadata columns.
-create_table_query = """
-CREATE TABLE markers (
-    id SERIAL PRIMARY KEY,
-    label TEXT,
-    score REAL,
-    geom geometry(Point,4326),
-    bounding_box geometry(Polygon,4326),
-    projection_path TEXT,
-    detection_path TEXT,
-    crop_path TEXT,
-    depth_path TEXT,
-    source_path TEXT,            -- Equirectangular image path from source->path
-    gps_img_direction REAL,      -- GPSImgDirection from source metadata
-    object_depth REAL,           -- Estimated object depth (meters) from objects->object_idx->depth
-    object_relative_angle REAL   -- Object relative angle from objects->object_idx->relative_angle
-);
-"""
-print("[DEBUG] Creating table 'markers' with GIS and additional metadata columns...")
-cur.execute(create_table_query)
-conn.commit()
-print("[DEBUG] Table 'markers' created successfully.")
+# Register a new generation: it is built in its own table while 'markers' keeps serving.
+ensure_registry(conn)
+generation = new_generation()
+load_table = generation_table(generation)
+register_loading(conn, generation)
+log.info("Loading generation %s into table '%s'...", generation, load_table)
 
-# Create a spatial index on the geom column for faster spatial queries.
-create_index_query = "CREATE INDEX idx_markers_geom ON markers USING GIST (geom);"
-print("[DEBUG] Creating spatial index on markers.geom...")
-cur.execute(create_index_query)
+# Create the generation table with GIS columns and additional metadata columns.
+# Records are first loaded into a session-local staging table, in file order.
+# The generation table is then filled from it in a single pass sorted by capture
+# time, so that its heap is correlated with captured_at across all campaigns,
+# which is what the BRIN index relies on. File paths group captures by device
+# and sequence rather than by date, so file order alone does not give that.
+queries = load_queries(load_table, MARKER_COLUMNS)
+log.debug("Creating table '%s' with GIS and additional metadata columns...", load_table)
+cur.execute(queries["create"])
+cur.execute(queries["create_staging"])
 conn.commit()
-print("[DEBUG] Spatial index created.")
+log.debug("Table '%s' created successfully.", load_table)
 
-# Prepare a list of records for insertion from the markers data
-records = []
-for marker in markers:
-    try:
-        decimal_lat = marker["computed_location"]["decimal_lat"]
-        decimal_lon = marker["computed_location"]["decimal_lon"]
-    except KeyError:
-        print("[DEBUG] Skipping marker with missing computed_location:", marker)
-        continue
+# Decode metadata files batch by batch and insert each batch's records.
+insert_sql = queries["insert"].as_string(conn)
+inserted = 0
+skipped = 0
+try:
+    log.info("Inserting records into the database (%s geometries, %d files per batch)...", GEOM_FORMAT, BATCH_FILES)
+    for batch in iter_file_batches(metadata_files, BATCH_FILES):
+        with profiler.stage("read") as stage:
+            metas, failed, bytes_read = read_metadata_files(batch)
+            stage.add(items=len(batch), bytes_read=bytes_read)
+        for filepath, error in failed:
+            log.warning("Error reading %s: %s", filepath, error)
+        with profiler.stage("decode") as stage:
+            records, batch_skipped = decode_metadata(metas, GEOM_FORMAT)
+            stage.add(items=len(records) + batch_skipped)
+        with profiler.stage("insert") as stage:
+            execute_values(cur, insert_sql, records, page_size=1000)
+            stage.add(items=len(records))
+        inserted += len(records)
+        skipped += batch_skipped
+        log.debug("Inserted batch of %d files (%d markers so far).", len(batch), inserted)
+    with profiler.stage("insert"):
+        conn.commit()
+    log.info("Staged %d markers (%d objects skipped).", inserted, skipped)
 
-    # Build WKT for the point geometry.
-    point_wkt = f'SRID=4326;POINT({decimal_lon} {decimal_lat})'
-    
-    # Get bounding box WKT if available.
-    bbox_wkt = marker.get("bbox_wkt")
-    if bbox_wkt:
-        bbox_wkt = f"SRID=4326;{bbox_wkt}"
-        print(f"[DEBUG] Using bounding_box WKT: {bbox_wkt}")
-    else:
-        bbox_wkt = None
-        print("[DEBUG] No bounding_box WKT for marker, setting to NULL.")
+    log.info("Copying markers into '%s' in capture-time order...", load_table)
+    with profiler.stage("sort") as stage:
+        cur.execute(queries["copy"])
+        cur.execute(queries["drop_staging"])
+        conn.commit()
+        stage.add(items=inserted)
+    log.info("Inserted %d markers into the database.", inserted)
 
-    # Build the record tuple with the new columns:
-    record = (
-        marker.get("label", "Unknown").strip(),
-        marker.get("score", 0.0),
-        point_wkt,
-        bbox_wkt,
-        marker.get("projection_path", ""),
-        marker.get("detection_path", marker.get("projection_path", "")),
-        marker.get("crop_path", ""),
-        marker.get("depth_path", ""),
-        marker.get("source", {}).get("path", ""),                # source_path from meta["source"]["path"]
-        marker.get("source", {}).get("GPSImgDirection", 0.0),      # gps_img_direction
-        marker.get("depth", 0.0),                                  # object_depth
-        marker.get("relative_angle", 0.0)                          # object_relative_angle
-    )
-    print("[DEBUG] Prepared record:", record)
-    records.append(record)
+    # Indexes are built after the load, on the generation table. Index names are
+    # global, so they carry the generation.
+    # The spatial index serves the viewport, nearest and corridor queries.
+    log.info("Creating spatial index on geom...")
+    with profiler.stage("index_gist"):
+        cur.execute(sql.SQL("CREATE INDEX {index} ON {table} USING GIST (geom);").format(
+            index=sql.Identifier(f"idx_{load_table}_geom"), table=sql.Identifier(load_table)))
+    # A BRIN index on the capture time allows cheap time-range filtering: it
+    # stores one min/max summary per block range, so it stays tiny and is
+    # effective because the table was filled in capture-time order.
+    log.info("Creating BRIN index on captured_at...")
+    with profiler.stage("index_brin"):
+        cur.execute(sql.SQL("CREATE INDEX {index} ON {table} USING BRIN (captured_at) WITH (pages_per_range = 16);").format(
+            index=sql.Identifier(f"idx_{load_table}_captured_at"), table=sql.Identifier(load_table)))
+        conn.commit()
+    log.info("Indexes created.")
 
-print(f"[DEBUG] Prepared {len(records)} records for insertion.")
+    with profiler.stage("analyze") as stage:
+        count = finish_loading(conn, generation)
+        stage.add(items=count)
+    log.info("Analyzed generation %s (%d markers).", generation, count)
 
-# Prepare the INSERT query using execute_values for efficient bulk insert.
-insert_query = """
-INSERT INTO markers (
-    label, score, geom, bounding_box, projection_path, detection_path, crop_path, depth_path,
-    source_path, gps_img_direction, object_depth, object_relative_angle
-)
-VALUES %s;
-"""
-
-try:
-    print("[DEBUG] Inserting records into the database...")
-    from psycopg2.extras import execute_values
-    execute_values(cur, insert_query, records)
-    conn.commit()
-    print(f"[DEBUG] Inserted {len(records)} markers into the database.")
+    # Per-label summary and viewport facet cells, served by /categories.
+    log.info("Building category summary and facet cells...")
+    with profiler.stage("facets") as stage:
+        cells = build_category_facets(conn, generation, load_table)
+        stage.add(items=cells)
+    log.info("Built %d category facet cells.", cells)
 except Exception as e:
     conn.rollback()
-    print("[DEBUG] Error inserting markers:", e)
+    log.error("Error loading generation %s, the live table is left untouched: %s", generation, e)
+    drop_generation(conn, generation)
+    conn.close()
+    exit(1)
 
-# Query the table to verify the inserted data
+# Swap the new generation in: two renames in one short transaction.
 try:
-    print("[DEBUG] Querying the first 10 markers from the database:")
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("""
-        SELECT id, label, score, ST_AsText(geom) AS geom, 
-               ST_AsText(bounding_box) AS bounding_box, 
-               projection_path, detection_path, crop_path, depth_path,
-               source_path, gps_img_direction, object_depth, object_relative_angle 
-        FROM markers LIMIT 10;
-    """)
-    rows = cur.fetchall()
-    for row in rows:
-        print("[DEBUG] Queried marker:", row)
-    cur.close()
+    with profiler.stage("swap"):
+        previous = swap_in(conn, generation)
+    log.info("Generation %s is live (previous generation: %s).", generation, previous)
 except Exception as e:
-    print("[DEBUG] Error querying markers:", e)
+    conn.rollback()
+    log.error("Error swapping in generation %s, the live table is left untouched: %s", generation, e)
+    conn.close()
+    exit(1)
 
-# Optionally, display the table structure information
+# Drop generations older than the one kept for rollback.
 try:
-    print("[DEBUG] Querying table structure for 'markers':")
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT column_name, data_type 
-        FROM information_schema.columns 
-        WHERE table_name = 'markers';
-    """)
-    columns = cur.fetchall()
-    print("[DEBUG] Table 'markers' columns:")
-    for col in columns:
-        print(f"   {col[0]} ({col[1]})")
-    cur.close()
+    with profiler.stage("gc"):
+        dropped = garbage_collect(conn, exclude=(generation,))
+    log.info("Dropped old generations: %s", dropped)
 except Exception as e:
-    print("[DEBUG] Error querying table structure:", e)
+    conn.rollback()
+    log.error("Error dropping old generations: %s", e)
+
+# Query the table to verify the inserted data, only when DEBUG output is enabled.
+if log.isEnabledFor(logging.DEBUG):
+    try:
+        log.debug("Querying the first 10 markers from the database:")
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute("""
+            SELECT id, label, score, ST_AsText(geom) AS geom, 
+                   ST_AsText(bounding_box) AS bounding_box, 
+                   projection_path, detection_path, crop_path, depth_path,
+                   source_path, gps_img_direction, object_depth, object_relative_angle,
+                   captured_at
+            FROM markers LIMIT 10;
+        """)
+        rows = cur.fetchall()
+        for row in rows:
+            log.debug("Queried marker: %s", row)
+        cur.close()
+    except Exception as e:
+        conn.rollback()
+        log.error("Error querying markers: %s", e)
+
+    # Display the table structure information
+    try:
+        log.debug("Querying table structure for 'markers':")
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT column_name, data_type 
+            FROM information_schema.columns 
+            WHERE table_name = 'markers';
+        """)
+        columns = cur.fetchall()
+        log.debug("Table 'markers' columns:")
+        for col in columns:
+            log.debug("   %s (%s)", col[0], col[1])
+        cur.close()
+    except Exception as e:
+        conn.rollback()
+        log.error("Error querying table structure: %s", e)
+
+# Publish a new snapshot generation for workers serving from memory.
+if MARKER_SNAPSHOT_DIR:
+    try:
+        with profiler.stage("snapshot") as stage:
+            name, count = publish_snapshot(conn, MARKER_SNAPSHOT_DIR, generation)
+            stage.add(items=count, bytes_written=os.path.getsize(os.path.join(MARKER_SNAPSHOT_DIR, name)))
+        log.info("Published marker snapshot %s (%d markers) to %s.", name, count, MARKER_SNAPSHOT_DIR)
+    except Exception as e:
+        conn.rollback()
+        log.error("Error publishing marker snapshot: %s", e)
 
 conn.close()
-print("[DEBUG] Database connection closed.")
+log.info("Database connection closed.")
+
+profiler.finish(
+    log, generation=generation, files=len(metadata_files), inserted=inserted, skipped=skipped,
+    geom_format=GEOM_FORMAT, batch_files=BATCH_FILES
+)
 
 print("""
 [RECOMMENDATION]
-The 'markers' table has been reset and set up with the following columns:
+The 'markers' table has been reloaded with the following columns:
  - id: Primary key.
  - label: Marker label.
  - score: Detection confidence score.
@@ -301,6 +269,10 @@ The 'markers' table has been reset and set up with the following columns:
  - gps_img_direction: GPS image direction.
  - object_depth: Estimated depth of the object.
  - object_relative_angle: Relative angle of the object.
+ - captured_at: Capture time of the source panorama (UTC).
 
-A spatial index on the geom column (idx_markers_geom) has been created to optimize spatial queries.
+A spatial index on the geom column (idx_markers_<generation>_geom) has been created to optimize spatial queries.
+A BRIN index on the captured_at column (idx_markers_<generation>_captured_at) supports time-range filtering.
+Per-label totals and facet counts are in marker_category_summary and marker_category_cells.
+The previous generation is kept; restore it with: python src/table_generations.py rollback
 """)
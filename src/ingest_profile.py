@@ -0,0 +1,223 @@
+"""
+Profiling and logging for the ingest scripts (generate_db.py, filter_metadata.py).
+
+Work is timed in named stages. Each stage accumulates, over all the times it is
+entered, its wall and CPU time, the number of items processed and the bytes
+read and written. With profiling enabled it also records the peak resident
+memory reached while it ran: on Linux the high-water mark of the process
+(VmHWM) is reset through /proc/self/clear_refs when a stage is entered and read
+back when it exits, so interleaved stages each get their own peak. Elsewhere
+the per-stage peak is not available (null). With profiling enabled the stages are written as a JSON report at
+the end of the run, and the whole run can also be recorded with cProfile.
+
+Environment variables:
+  INGEST_PROFILE           Path of the JSON report (profiling is off when unset).
+  INGEST_PROFILE_CPROFILE  Path of a cProfile dump of the run (pstats format, which
+                           snakeviz, flameprof or gprof2dot turn into flame graphs).
+  INGEST_LOG_LEVEL         Logging level of the ingest scripts (default INFO).
+
+Report layout:
+  {"script", "started_at", "wall_s", "cpu_s", "peak_rss_bytes", "extra",
+   "stages": {name: {"calls", "wall_s", "cpu_s", "items", "items_per_s",
+                     "bytes_read", "bytes_written", "peak_rss_bytes"}}}
+The top-level peak_rss_bytes is the peak of the whole run.
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import cProfile
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Not available on Windows.
+    resource = None
+
+LOG_FORMAT = "[%(levelname)s] %(message)s"
+
+
+def setup_logging(name):
+    """Return the logger of an ingest script, at the level given by INGEST_LOG_LEVEL."""
+    level = os.environ.get("INGEST_LOG_LEVEL", "INFO").upper()
+    logging.basicConfig(format=LOG_FORMAT, level=getattr(logging, level, logging.INFO))
+    return logging.getLogger(name)
+
+
+def peak_rss_bytes():
+    """Peak resident memory of the process so far, or None if unknown."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def reset_peak_rss():
+    """Reset the peak resident memory of the process (Linux only). Returns whether it was reset."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def high_water_rss_bytes():
+    """Peak resident memory since the last reset_peak_rss, or None if unknown."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+class Stage:
+    """Counters of one named stage."""
+
+    __slots__ = ("calls", "wall", "cpu", "items", "bytes_read", "bytes_written", "peak_rss")
+
+    def __init__(self):
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.items = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.peak_rss = None
+
+    def add(self, items=0, bytes_read=0, bytes_written=0):
+        self.items += items
+        self.bytes_read += bytes_read
+        self.bytes_written += bytes_written
+
+    def as_dict(self):
+        return {
+            "calls": self.calls,
+            "wall_s": round(self.wall, 6),
+            "cpu_s": round(self.cpu, 6),
+            "items": self.items,
+            "items_per_s": round(self.items / self.wall, 1) if self.wall > 0 else None,
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+            "peak_rss_bytes": self.peak_rss,
+        }
+
+
+class IngestProfiler:
+    """
+    Stage timer of an ingest run. Stages are always timed (it costs two clock
+    reads per stage); the report and the cProfile dump are only written when
+    their path is set. Use `enabled` to skip bookkeeping that has a cost of its
+    own, such as stat calls to count bytes.
+    """
+
+    def __init__(self, script, report_path=None, cprofile_path=None):
+        self.script = script
+        self.report_path = report_path
+        self.cprofile_path = cprofile_path
+        self.enabled = bool(report_path or cprofile_path)
+        self.stages = {}
+        self.open_stages = []
+        # Resetting the high-water mark also lowers ru_maxrss, so the peak of
+        # the run is tracked here once per-stage peaks are measured.
+        self.run_peak_rss = None
+        self.started_at = time.time()
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        self.cprofile = None
+
+    @classmethod
+    def from_env(cls, script):
+        return cls(
+            script,
+            report_path=os.environ.get("INGEST_PROFILE"),
+            cprofile_path=os.environ.get("INGEST_PROFILE_CPROFILE"),
+        )
+
+    def start(self):
+        """Restart the run clocks, and start cProfile if a dump was requested."""
+        self.started_at = time.time()
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        if self.cprofile_path:
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+    @contextmanager
+    def stage(self, name):
+        """Time a block as (one more call of) stage `name`; yields the Stage to count items and bytes."""
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = Stage()
+        if self.enabled:
+            self._sample_peak_rss()
+            self.open_stages.append(stage)
+            if not reset_peak_rss():
+                stage.peak_rss = None
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield stage
+        finally:
+            stage.wall += time.perf_counter() - wall
+            stage.cpu += time.process_time() - cpu
+            stage.calls += 1
+            if self.enabled:
+                self._sample_peak_rss()
+                self.open_stages.pop()
+
+    def _sample_peak_rss(self):
+        """
+        Fold the high-water mark since the last reset into the stages still
+        running (an enclosing stage keeps its peak across the reset of an inner
+        one) and into the peak of the run.
+        """
+        peak = high_water_rss_bytes()
+        if peak is None:
+            return
+        for stage in self.open_stages:
+            stage.peak_rss = max(stage.peak_rss or 0, peak)
+        self.run_peak_rss = max(self.run_peak_rss or 0, peak)
+
+    def report(self, **extra):
+        return {
+            "script": self.script,
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.started_at)),
+            "wall_s": round(time.perf_counter() - self.wall_start, 6),
+            "cpu_s": round(time.process_time() - self.cpu_start, 6),
+            "peak_rss_bytes": max(filter(None, (peak_rss_bytes(), self.run_peak_rss)), default=None),
+            "extra": extra,
+            "stages": {name: stage.as_dict() for name, stage in self.stages.items()},
+        }
+
+    def finish(self, log=None, **extra):
+        """
+        Stop cProfile and write its dump, write the JSON report, and log a one
+        line summary per stage. `extra` values (counts, settings) go into the
+        report as is. Returns the report.
+        """
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(self.cprofile_path)
+            self.cprofile = None
+        report = self.report(**extra)
+        if self.report_path:
+            with open(self.report_path, "w") as f:
+                json.dump(report, f, indent=2)
+        if log is not None and self.enabled:
+            for name, stage in report["stages"].items():
+                log.info(
+                    "%-12s %9.3fs wall %9.3fs cpu %10d items %12s items/s",
+                    name, stage["wall_s"], stage["cpu_s"], stage["items"], stage["items_per_s"]
+                )
+            if self.report_path:
+                log.info("Profile report written to %s", self.report_path)
+            if self.cprofile_path:
+                log.info("cProfile dump written to %s", self.cprofile_path)
+        return report
@@ -11,15 +11,17 @@ from dotenv import load_dotenv
 import psycopg2
 from psycopg2.extras import execute_values, RealDictCursor
 
+from db_routing import DB_DEFAULTS
+
 # Load environment variables from .env
 load_dotenv()
 
 # Retrieve connection details from environment variables
-DB_NAME = os.environ.get("DB_NAME", "geodb")
-DB_USER = os.environ.get("DB_USER", "postgres")
-DB_PASS = os.environ.get("DB_PASS", "")
-DB_HOST = os.environ.get("DB_HOST", "localhost")
-DB_PORT = os.environ.get("DB_PORT", "5432")
+DB_NAME = os.environ.get("DB_NAME", DB_DEFAULTS["DB_NAME"])
+DB_USER = os.environ.get("DB_USER", DB_DEFAULTS["DB_USER"])
+DB_PASS = os.environ.get("DB_PASS", DB_DEFAULTS["DB_PASS"])
+DB_HOST = os.environ.get("DB_HOST", DB_DEFAULTS["DB_HOST"])
+DB_PORT = os.environ.get("DB_PORT", DB_DEFAULTS["DB_PORT"])
 
 # Connect to the Azure managed PostgreSQL database
 try:
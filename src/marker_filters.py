@@ -0,0 +1,83 @@
+"""
+SQL filter fragments shared by the Flask routes and the command line tools.
+
+Each builder takes raw parameter values (as found in a query string or on the
+command line) and returns (clause, params), where clause starts with ' AND'
+(or is empty) and params are the values for its %s placeholders.
+"""
+
+import math
+from datetime import datetime, timedelta, timezone
+
+
+def parse_time_bound(value, is_upper):
+    """
+    Parse an ISO 8601 date or datetime query value into an aware datetime (UTC if
+    no offset is given). A date-only upper bound is moved to the start of the next
+    day so that the whole day is included.
+    """
+    value = value.strip()
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    if is_upper and 'T' not in value and ' ' not in value:
+        parsed += timedelta(days=1)
+    return parsed
+
+
+def parse_bbox(minlat, minlon, maxlat, maxlon):
+    """Convert bounding box values to finite floats. Raises TypeError/ValueError if invalid."""
+    bbox = float(minlat), float(minlon), float(maxlat), float(maxlon)
+    if not all(math.isfinite(value) for value in bbox):
+        raise ValueError("Bounding box values must be finite numbers.")
+    return bbox
+
+
+def bbox_clause(bbox):
+    """
+    Build the index-assisted bounding box filter on geom.
+    bbox is a (minlat, minlon, maxlat, maxlon) tuple of floats, or None.
+    """
+    if bbox is None:
+        return "", []
+    minlat, minlon, maxlat, maxlon = bbox
+    return " AND geom && ST_MakeEnvelope(%s, %s, %s, %s, 4326)", [minlon, minlat, maxlon, maxlat]
+
+
+def category_clause(categories_param):
+    """Build the label filter from a comma separated list of categories."""
+    if categories_param:
+        cat_list = [cat.strip() for cat in categories_param.split(',') if cat.strip()]
+        if cat_list:
+            placeholders = ",".join(["%s"] * len(cat_list))
+            return f" AND label IN ({placeholders})", cat_list
+    return "", []
+
+
+def time_range_bounds(time_from, time_to):
+    """
+    Parse optional ISO 8601 'from' and 'to' bounds into a [lower, upper) pair of
+    aware datetimes (None when absent). Raises ValueError if a bound is malformed.
+    """
+    lower = parse_time_bound(time_from, is_upper=False) if time_from else None
+    upper = parse_time_bound(time_to, is_upper=True) if time_to else None
+    return lower, upper
+
+
+def time_range_clause(time_from, time_to):
+    """
+    Build the capture-time filter from optional ISO 8601 'from' and 'to' bounds.
+    Raises ValueError if a bound is malformed.
+    """
+    lower, upper = time_range_bounds(time_from, time_to)
+    clause = ""
+    params = []
+    if lower is not None:
+        clause += " AND captured_at >= %s"
+        params.append(lower)
+    if upper is not None:
+        clause += " AND captured_at < %s"
+        params.append(upper)
+    return clause, params
@@ -0,0 +1,500 @@
+#!/usr/bin/env python3
+"""
+Memory-mapped snapshot of the markers table for serving viewport queries
+without a database round trip.
+
+A snapshot is a single file holding column arrays (coordinates, label ids,
+scores, ids, capture times) sorted along a packed uniform grid index, plus the
+pre-serialized JSON of every marker as returned by /markers. Workers map the
+file read-only, so forked workers share the same pages through the OS page
+cache, and a bbox query only touches the grid cells it overlaps.
+
+Snapshots are published into a directory as 'markers-<generation>.snap' and the
+file name of the live generation is written atomically to a 'CURRENT' file.
+Serving workers re-read 'CURRENT' at most every check interval and switch to a
+new generation as soon as it is published.
+
+File layout: MAGIC, a little-endian uint64 header length, a JSON header
+(generation, labels, grid parameters, array dtypes/shapes/offsets), then the
+arrays, each aligned to 64 bytes.
+
+Build and publish a snapshot from the database:
+  python src/marker_snapshot.py /path/to/snapshots
+"""
+
+import os
+import sys
+import json
+import math
+import mmap
+import time
+import struct
+import logging
+from datetime import datetime, timezone
+from email.utils import format_datetime
+import numpy as np
+from psycopg2.extras import RealDictCursor
+from dotenv import load_dotenv
+
+from db_routing import DatabaseRouter
+
+log = logging.getLogger(__name__)
+
+MAGIC = b"OMSNAP01"
+CURRENT_FILE = "CURRENT"
+ALIGNMENT = 64
+# Number of published generations kept on disk (the live one included).
+KEEP_GENERATIONS = 2
+# Average number of markers per grid cell, and the largest grid side.
+POINTS_PER_CELL = 8
+MAX_GRID_SIDE = 4096
+# Capture-time value of markers without a capture time.
+NO_CAPTURE_TIME = np.iinfo(np.int64).min
+# Resolution of link_points (grid cells per cluster distance), bound on the
+# number of point pairs it compares at once, and on the number it compares in
+# total before linking the remaining cells on their centers.
+LINK_STEPS = 4
+MAX_PAIRS_PER_CHUNK = 1 << 21
+MAX_EXACT_PAIRS = 1 << 24
+
+SNAPSHOT_QUERY = """
+    SELECT id, label, score, projection_path, detection_path, crop_path, depth_path,
+           source_path, object_depth, captured_at,
+           ST_AsGeoJSON(geom) AS geom,
+           ST_AsGeoJSON(bounding_box) AS bounding_box,
+           ST_X(geom) AS lon, ST_Y(geom) AS lat
+    FROM markers
+    WHERE geom IS NOT NULL
+"""
+# Columns of SNAPSHOT_QUERY serialized into the /markers JSON of each marker.
+ROW_COLUMNS = (
+    "id", "label", "score", "projection_path", "detection_path", "crop_path", "depth_path",
+    "source_path", "object_depth", "captured_at", "geom", "bounding_box",
+)
+
+
+def _json_default(value):
+    # Same representation as Flask's jsonify for datetimes (HTTP date).
+    if isinstance(value, datetime):
+        return format_datetime(value.astimezone(timezone.utc), usegmt=True)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _epoch_ms(value):
+    """Milliseconds since the epoch of an aware datetime, or NO_CAPTURE_TIME for None."""
+    if value is None:
+        return NO_CAPTURE_TIME
+    return int(value.timestamp() * 1000)
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def build_grid(lon, lat):
+    """Choose uniform grid parameters covering the points, about POINTS_PER_CELL per cell."""
+    minlon, maxlon = float(lon.min()), float(lon.max())
+    minlat, maxlat = float(lat.min()), float(lat.max())
+    width = max(maxlon - minlon, 1e-9)
+    height = max(maxlat - minlat, 1e-9)
+    ncells = max(len(lon) // POINTS_PER_CELL, 1)
+    nx = min(max(int(round(math.sqrt(ncells * width / height))), 1), MAX_GRID_SIDE)
+    ny = min(max(int(math.ceil(ncells / nx)), 1), MAX_GRID_SIDE)
+    # Widen the cells slightly so the max coordinates fall inside the last cell.
+    return {
+        "minlon": minlon, "minlat": minlat,
+        "cell_width": width * (1 + 1e-9) / nx, "cell_height": height * (1 + 1e-9) / ny,
+        "nx": nx, "ny": ny,
+    }
+
+
+def _cell_ids(lon, lat, grid):
+    cx = np.clip(((lon - grid["minlon"]) / grid["cell_width"]).astype(np.int64), 0, grid["nx"] - 1)
+    cy = np.clip(((lat - grid["minlat"]) / grid["cell_height"]).astype(np.int64), 0, grid["ny"] - 1)
+    return cy * grid["nx"] + cx
+
+
+def write_snapshot(path, rows, generation):
+    """
+    Write a snapshot file from rows of SNAPSHOT_QUERY (dicts).
+    Returns the number of markers written.
+    """
+    n = len(rows)
+    lon = np.array([row["lon"] for row in rows], dtype=np.float64)
+    lat = np.array([row["lat"] for row in rows], dtype=np.float64)
+    labels = sorted({row["label"] for row in rows if row["label"] is not None})
+    label_index = {label: i for i, label in enumerate(labels)}
+    label_ids = np.array([label_index.get(row["label"], -1) for row in rows], dtype=np.int32)
+    scores = np.array([row["score"] if row["score"] is not None else np.nan for row in rows], dtype=np.float32)
+    ids = np.array([row["id"] for row in rows], dtype=np.int64)
+    captured = np.array([_epoch_ms(row["captured_at"]) for row in rows], dtype=np.int64)
+
+    if n:
+        grid = build_grid(lon, lat)
+        cells = _cell_ids(lon, lat, grid)
+        order = np.lexsort((ids, cells))
+        cells = cells[order]
+    else:
+        grid = {"minlon": 0.0, "minlat": 0.0, "cell_width": 1.0, "cell_height": 1.0, "nx": 1, "ny": 1}
+        order = np.zeros(0, dtype=np.int64)
+        cells = np.zeros(0, dtype=np.int64)
+    cell_start = np.searchsorted(cells, np.arange(grid["nx"] * grid["ny"] + 1)).astype(np.int64)
+
+    # Each row is stored followed by a comma so runs of consecutive rows can be
+    # copied out of the blob as a single slice.
+    encoded = [
+        json.dumps({key: rows[i][key] for key in ROW_COLUMNS}, sort_keys=True,
+                   separators=(",", ":"), default=_json_default).encode() + b","
+        for i in order.tolist()
+    ]
+    row_offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum([len(row) for row in encoded], out=row_offsets[1:])
+    row_blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+    arrays = {
+        "lon": lon[order], "lat": lat[order], "label_id": label_ids[order],
+        "score": scores[order], "id": ids[order], "captured_ms": captured[order],
+        "cell_start": cell_start, "row_offsets": row_offsets, "row_blob": row_blob,
+    }
+    layout, offset = {}, 0
+    for name, array in arrays.items():
+        offset = _align(offset)
+        layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset += array.nbytes
+    header = json.dumps({
+        "generation": generation, "count": n, "labels": labels, "grid": grid, "arrays": layout,
+    }).encode()
+    data_start = _align(len(MAGIC) + 8 + len(header))
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC + struct.pack("<Q", len(header)) + header)
+        for name, array in arrays.items():
+            f.seek(data_start + layout[name]["offset"])
+            f.write(np.ascontiguousarray(array).tobytes())
+        f.truncate(data_start + offset)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return n
+
+
+def _neighbour_cells(cell_keys, cell_table, stride, dx, dy):
+    """
+    Indices (a, b) of the pairs of occupied cells where b is at offset (dx, dy)
+    from a. cell_table, if not None, maps every key to its cell index (-1 when
+    empty); otherwise keys are looked up in the sorted cell_keys.
+    """
+    wanted = cell_keys + dx * stride + dy
+    if cell_table is not None:
+        target = cell_table[wanted]
+        match = target >= 0
+    else:
+        target = np.minimum(np.searchsorted(cell_keys, wanted), len(cell_keys) - 1)
+        match = cell_keys[target] == wanted
+    return np.flatnonzero(match), target[match]
+
+
+def _close_cell_pairs(x, y, order, starts, counts, a, b, distance):
+    """Pairs of cells (a, b) holding at least one pair of points within `distance`."""
+    sizes = counts[a] * counts[b]
+    cumulative = np.cumsum(sizes)
+    linked_a, linked_b = [], []
+    # Compare the members of the cells in memory-bounded chunks.
+    lo = 0
+    while lo < len(a):
+        hi = int(np.searchsorted(cumulative, cumulative[lo] - sizes[lo] + MAX_PAIRS_PER_CHUNK, side="right"))
+        hi = max(hi, lo + 1)
+        ca, cb, cs = a[lo:hi], b[lo:hi], sizes[lo:hi]
+        pair_id = np.repeat(np.arange(len(ca)), cs)
+        local = np.arange(cs.sum()) - np.repeat(np.cumsum(cs) - cs, cs)
+        nb = counts[cb][pair_id]
+        i = order[starts[ca][pair_id] + local // nb]
+        j = order[starts[cb][pair_id] + local % nb]
+        close = (x[i] - x[j]) ** 2 + (y[i] - y[j]) ** 2 <= distance * distance
+        linked_a.append(ca[pair_id[close]])
+        linked_b.append(cb[pair_id[close]])
+        lo = hi
+    return linked_a, linked_b
+
+
+def link_points(lon, lat, distance):
+    """
+    Single-linkage components of points within `distance` of each other
+    (Euclidean distance in degrees, as ST_ClusterWithin).
+    Returns (labels, exact): a component label (0..k-1) per point, and whether
+    the result is exact.
+
+    Points go into grid cells of side distance/LINK_STEPS, whose points are all
+    linked together. Two cells are linked without looking at their points when
+    even their farthest corners are within `distance`, and never when their
+    nearest sides are farther apart. Only cells between the two cases have
+    their points compared, so the work stays proportional to the points near
+    the threshold. If that would mean more than MAX_EXACT_PAIRS comparisons,
+    those cells are linked on their centers instead: pairs of points whose
+    distance is within distance * sqrt(2) / LINK_STEPS of the threshold may
+    then be linked differently than by PostGIS, and exact is False.
+    """
+    n = len(lon)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64), True
+    # Duplicate coordinates are linked whatever the distance.
+    coords, inverse = np.unique(np.stack([lon, lat], axis=1), axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    if distance <= 0:
+        return inverse, True
+    x, y = coords[:, 0], coords[:, 1]
+
+    cell = distance / LINK_STEPS
+    reach = LINK_STEPS + 1
+    cx = np.floor((x - x.min()) / cell).astype(np.int64)
+    # Rows start at `reach` and leave `reach` empty rows above the top one, so
+    # keys at any offset stay positive and never wrap onto the next column.
+    cy = np.floor((y - y.min()) / cell).astype(np.int64) + reach
+    stride = int(cy.max()) + reach + 1
+    keys = cx * stride + cy
+    order = np.argsort(keys, kind="stable")
+    cell_keys, starts, counts = np.unique(keys[order], return_index=True, return_counts=True)
+    cell_of = np.empty(len(x), dtype=np.int64)
+    cell_of[order] = np.repeat(np.arange(len(cell_keys)), counts)
+    # Look neighbours up in a dense table of the grid when it is not much larger
+    # than the points (offsets go up to `reach` columns past the last one).
+    cell_table = None
+    table_size = (int(cx.max()) + reach + 1) * stride
+    if table_size <= max(16 * len(x), 1 << 20):
+        cell_table = np.full(table_size, -1, dtype=np.int64)
+        cell_table[cell_keys] = np.arange(len(cell_keys))
+
+    steps2 = LINK_STEPS * LINK_STEPS
+    linked_a, linked_b = [], []
+    maybe = []
+    for dx in range(0, reach + 1):
+        for dy in range(-reach, reach + 1):
+            if dx == 0 and dy <= 0:
+                continue
+            gap2 = max(dx - 1, 0) ** 2 + max(abs(dy) - 1, 0) ** 2
+            if gap2 > steps2:
+                continue
+            a, b = _neighbour_cells(cell_keys, cell_table, stride, dx, dy)
+            if not len(a):
+                continue
+            if (dx + 1) ** 2 + (abs(dy) + 1) ** 2 < steps2:
+                linked_a.append(a)
+                linked_b.append(b)
+            else:
+                maybe.append((a, b, dx * dx + dy * dy))
+
+    exact = sum(int((counts[a] * counts[b]).sum()) for a, b, _ in maybe) <= MAX_EXACT_PAIRS
+    for a, b, center2 in maybe:
+        if exact:
+            close_a, close_b = _close_cell_pairs(x, y, order, starts, counts, a, b, distance)
+            linked_a += close_a
+            linked_b += close_b
+        elif center2 <= steps2:
+            linked_a.append(a)
+            linked_b.append(b)
+
+    parent = np.arange(len(cell_keys))
+    if linked_a:
+        pi, pj = np.concatenate(linked_a), np.concatenate(linked_b)
+        # Hook the root of each linked pair onto the smaller root, then compress
+        # paths, until both ends of every pair share the same root.
+        while not np.array_equal(parent[pi], parent[pj]):
+            ri, rj = parent[pi], parent[pj]
+            low = np.minimum(ri, rj)
+            np.minimum.at(parent, ri, low)
+            np.minimum.at(parent, rj, low)
+            while True:
+                compressed = parent[parent]
+                if np.array_equal(compressed, parent):
+                    break
+                parent = compressed
+    _, labels = np.unique(parent[cell_of], return_inverse=True)
+    return labels.reshape(-1)[inverse], exact
+
+
+def cluster_points(lon, lat, distance):
+    """
+    Single-linkage clustering of points within `distance` (degrees), like
+    ST_ClusterWithin (see link_points for when it is exact).
+    Returns (centroid_lon, centroid_lat, counts) per cluster.
+    """
+    if len(lon) == 0:
+        return np.zeros(0), np.zeros(0), np.zeros(0, dtype=np.int64)
+    labels, _ = link_points(lon, lat, distance)
+    counts = np.bincount(labels)
+    return (
+        np.bincount(labels, weights=lon) / counts,
+        np.bincount(labels, weights=lat) / counts,
+        counts,
+    )
+
+
+class MarkerSnapshot:
+    """Read-only view of a snapshot file, backed by a shared memory map."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a marker snapshot.")
+        header_len = struct.unpack_from("<Q", self.mmap, len(MAGIC))[0]
+        header_start = len(MAGIC) + 8
+        header = json.loads(self.mmap[header_start:header_start + header_len])
+        data_start = _align(header_start + header_len)
+
+        self.generation = header["generation"]
+        self.count = header["count"]
+        self.labels = header["labels"]
+        self.grid = header["grid"]
+        for name, spec in header["arrays"].items():
+            dtype = np.dtype(spec["dtype"])
+            count = int(np.prod(spec["shape"]))
+            array = np.frombuffer(self.mmap, dtype=dtype, count=count, offset=data_start + spec["offset"])
+            setattr(self, name, array.reshape(spec["shape"]))
+        self.blob = memoryview(self.mmap)[data_start + header["arrays"]["row_blob"]["offset"]:]
+
+    def query(self, minlat, minlon, maxlat, maxlon, label_ids=None, time_from=None, time_to=None):
+        """
+        Return the positions of the markers inside the bbox (bounds included),
+        optionally restricted to label ids and to a [time_from, time_to) range of
+        aware datetimes.
+        """
+        g = self.grid
+        if self.count == 0:
+            return np.zeros(0, dtype=np.int64)
+        ix0 = math.floor((minlon - g["minlon"]) / g["cell_width"])
+        ix1 = math.floor((maxlon - g["minlon"]) / g["cell_width"])
+        iy0 = math.floor((minlat - g["minlat"]) / g["cell_height"])
+        iy1 = math.floor((maxlat - g["minlat"]) / g["cell_height"])
+        if ix1 < 0 or iy1 < 0 or ix0 >= g["nx"] or iy0 >= g["ny"] or ix0 > ix1 or iy0 > iy1:
+            return np.zeros(0, dtype=np.int64)
+        ix0, ix1 = max(ix0, 0), min(ix1, g["nx"] - 1)
+        iy0, iy1 = max(iy0, 0), min(iy1, g["ny"] - 1)
+
+        # Cells of one grid row are contiguous: one slice of markers per row.
+        rows = np.arange(iy0, iy1 + 1) * g["nx"]
+        starts = self.cell_start[rows + ix0]
+        lengths = self.cell_start[rows + ix1 + 1] - starts
+        total = int(lengths.sum())
+        idx = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths) + np.arange(total)
+
+        lon, lat = self.lon[idx], self.lat[idx]
+        mask = (lon >= minlon) & (lon <= maxlon) & (lat >= minlat) & (lat <= maxlat)
+        if label_ids is not None:
+            mask &= np.isin(self.label_id[idx], label_ids)
+        if time_from is not None or time_to is not None:
+            captured = self.captured_ms[idx]
+            mask &= captured != NO_CAPTURE_TIME
+            if time_from is not None:
+                mask &= captured >= _epoch_ms(time_from)
+            if time_to is not None:
+                mask &= captured < _epoch_ms(time_to)
+        return idx[mask]
+
+    def label_ids(self, categories):
+        """Ids of the given labels (unknown labels are ignored)."""
+        index = {label: i for i, label in enumerate(self.labels)}
+        return np.array([index[c] for c in categories if c in index], dtype=np.int32)
+
+    def label_counts(self, idx):
+        """/categories?bbox= rows (label and marker count) for the given markers."""
+        label_ids = self.label_id[idx]
+        counts = np.bincount(label_ids[label_ids >= 0], minlength=len(self.labels)).tolist()
+        return [
+            {"label": label, "marker_count": count}
+            for label, count in zip(self.labels, counts) if count
+        ]
+
+    def markers_json(self, idx):
+        """JSON array (bytes) of the /markers rows of the given (sorted) marker positions."""
+        if len(idx) == 0:
+            return b"[]"
+        # Markers of a grid row are stored contiguously: copy whole runs at once.
+        breaks = np.flatnonzero(np.diff(idx) != 1) + 1
+        run_starts = self.row_offsets[idx[np.concatenate(([0], breaks))]].tolist()
+        run_ends = self.row_offsets[idx[np.concatenate((breaks - 1, [len(idx) - 1]))] + 1].tolist()
+        body = b"".join([self.blob[s:e] for s, e in zip(run_starts, run_ends)])
+        return b"[" + body[:-1] + b"]"
+
+    def clusters(self, idx, distance):
+        """/markers_clustered rows for the given markers."""
+        lon, lat, counts = cluster_points(self.lon[idx], self.lat[idx], distance)
+        return [
+            {
+                "geom": json.dumps({"type": "Point", "coordinates": [round(x, 9), round(y, 9)]}, separators=(",", ":")),
+                "cluster_count": count,
+            }
+            for x, y, count in zip(lon.tolist(), lat.tolist(), counts.tolist())
+        ]
+
+
+class SnapshotStore:
+    """Keeps the live snapshot of a directory mapped, switching when a new generation is published."""
+
+    def __init__(self, directory, check_interval=2.0):
+        self.directory = directory
+        self.check_interval = check_interval
+        self.checked_at = None
+        self.loaded_name = None
+        self.snapshot = None
+
+    def current(self):
+        """Return the live MarkerSnapshot, or None if no snapshot is published."""
+        now = time.monotonic()
+        if self.checked_at is not None and now - self.checked_at < self.check_interval:
+            return self.snapshot
+        self.checked_at = now
+        try:
+            with open(os.path.join(self.directory, CURRENT_FILE)) as f:
+                name = f.read().strip()
+        except OSError:
+            name = None
+        if name != self.loaded_name:
+            try:
+                self.snapshot = MarkerSnapshot(os.path.join(self.directory, name)) if name else None
+                self.loaded_name = name
+            except (OSError, ValueError) as e:
+                log.error("Loading marker snapshot %s: %s", name, e)
+        return self.snapshot
+
+
+def publish_snapshot(conn, directory, generation=None):
+    """
+    Build a snapshot of the markers table, make it the live generation of
+    directory, and remove generations beyond KEEP_GENERATIONS.
+    Returns (file name, number of markers).
+    """
+    generation = generation or time.strftime("%Y%m%dT%H%M%S")
+    os.makedirs(directory, exist_ok=True)
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(SNAPSHOT_QUERY)
+        rows = cur.fetchall()
+    name = f"markers-{generation}.snap"
+    count = write_snapshot(os.path.join(directory, name), rows, generation)
+
+    tmp_current = os.path.join(directory, CURRENT_FILE + ".tmp")
+    with open(tmp_current, "w") as f:
+        f.write(name)
+    os.replace(tmp_current, os.path.join(directory, CURRENT_FILE))
+
+    published = sorted(f for f in os.listdir(directory) if f.startswith("markers-") and f.endswith(".snap"))
+    for old in published[:-KEEP_GENERATIONS]:
+        if old != name:
+            # Workers still mapping it keep their pages until they switch.
+            os.remove(os.path.join(directory, old))
+    return name, count
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print("Usage: python src/marker_snapshot.py SNAPSHOT_DIR")
+        sys.exit(1)
+    load_dotenv()
+    conn = DatabaseRouter.from_env().connect()
+    try:
+        name, count = publish_snapshot(conn, sys.argv[1])
+    finally:
+        conn.close()
+    print(f"[INFO] Published snapshot {name} with {count} markers.")
@@ -0,0 +1,74 @@
+"""
+Route parameters of /markers/along: decoding and limits.
+
+A route is given either as a GeoJSON LineString or as an encoded polyline
+(Google polyline algorithm, https://developers.google.com/maps/documentation/utilities/polylinealgorithm).
+The corridor query cuts it into pieces of at most ROUTE_PIECE_DEGREES, each
+looked up in the spatial index, so the work of a request grows with the length
+of the route: routes needing more than MAX_ROUTE_PIECES pieces are refused.
+"""
+
+import json
+import math
+
+MAX_ROUTE_POINTS = 5000
+# Longest route piece (degrees, about 200 m) probed on its own in the GiST index.
+ROUTE_PIECE_DEGREES = 0.002
+# Most pieces a route may be cut into (about 2,000 km of route).
+MAX_ROUTE_PIECES = 10000
+
+
+def decode_polyline(encoded, precision=5):
+    """Decode an encoded polyline (Google polyline algorithm) into [lon, lat] pairs."""
+    coords = []
+    index = lat = lon = 0
+    factor = 10 ** precision
+    while index < len(encoded):
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                if index >= len(encoded):
+                    raise ValueError("Truncated encoded polyline.")
+                b = ord(encoded[index]) - 63
+                index += 1
+                result |= (b & 0x1f) << shift
+                shift += 5
+                if b < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lon += deltas[1]
+        coords.append([lon / factor, lat / factor])
+    return coords
+
+
+def parse_route(line, polyline):
+    """
+    Return the route coordinates as a list of [lon, lat] pairs from either a GeoJSON
+    LineString (dict or JSON string) or an encoded polyline.
+    Raises ValueError if the route is missing or malformed.
+    """
+    if polyline:
+        coords = decode_polyline(polyline)
+    elif line:
+        if isinstance(line, str):
+            line = json.loads(line)
+        if not isinstance(line, dict) or line.get('type') != 'LineString':
+            raise ValueError("'line' must be a GeoJSON LineString.")
+        coords = [[float(c[0]), float(c[1])] for c in line.get('coordinates', [])]
+    else:
+        raise ValueError("Missing 'line' or 'polyline' parameter.")
+    if not 2 <= len(coords) <= MAX_ROUTE_POINTS:
+        raise ValueError(f"A route needs between 2 and {MAX_ROUTE_POINTS} points.")
+    if not all(-180 <= lon <= 180 and -90 <= lat <= 90 for lon, lat in coords):
+        raise ValueError("Route coordinates out of range.")
+    return coords
+
+
+def route_piece_count(coords):
+    """Number of pieces ST_Segmentize(route, ROUTE_PIECE_DEGREES) cuts the route into."""
+    return sum(
+        max(math.ceil(math.hypot(lon1 - lon0, lat1 - lat0) / ROUTE_PIECE_DEGREES), 1)
+        for (lon0, lat0), (lon1, lat1) in zip(coords, coords[1:])
+    )
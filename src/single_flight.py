@@ -0,0 +1,62 @@
+"""
+Coalescing of identical concurrent calls ("single flight").
+
+While a call for a given key is running, other threads asking for the same key
+wait for it and share its result (or its exception) instead of running it
+again. If the call is interrupted by a BaseException that is not an Exception
+(SystemExit, KeyboardInterrupt, a gevent Timeout), the interruption belongs to
+the caller that ran it: the waiting callers get a SingleFlightInterrupted
+error instead. Nothing is cached: once the call completes, the next request for that
+key runs it again.
+
+Coalescing is per process; with several worker processes each one runs at
+most one execution per distinct in-flight query.
+"""
+
+import threading
+
+
+class SingleFlightInterrupted(RuntimeError):
+    """The call shared by a waiting caller was interrupted in the thread running it."""
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.shared = 0
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time and shares its outcome with concurrent callers."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, fn):
+        """Return fn() for key, joining a call already in flight for the same key if any."""
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+            else:
+                call.shared += 1
+        if leader:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                call.error = e
+            finally:
+                with self.lock:
+                    del self.calls[key]
+                call.done.set()
+        else:
+            call.done.wait()
+        if call.error is not None:
+            if leader or isinstance(call.error, Exception):
+                raise call.error
+            raise SingleFlightInterrupted(f"Shared call interrupted: {call.error!r}") from call.error
+        return call.result
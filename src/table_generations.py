@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+Generations of the markers table, for reloads without downtime.
+
+A full reload builds a new generation in its own table ('markers_<generation>'),
+including its indexes and statistics, while the live 'markers' table keeps
+serving. The new generation is then swapped in by two renames inside one short
+transaction: the live table goes back to its generation name and the new table
+becomes 'markers'. Previous generations are kept for instant rollback and
+dropped by garbage collection.
+
+The 'marker_generations' table records every generation and its status:
+'loading' (being built), 'live' (currently 'markers') or 'retired'.
+
+When MARKER_SNAPSHOT_DIR is set, a rollback also publishes a snapshot of the
+restored table there, so workers serving from memory switch along with it
+(see marker_snapshot.py).
+
+Command line:
+  python src/table_generations.py list
+  python src/table_generations.py rollback
+  python src/table_generations.py gc [number_of_retired_generations_to_keep]
+"""
+
+import os
+import sys
+import time
+import random
+import logging
+from psycopg2 import sql, errors
+from dotenv import load_dotenv
+
+from db_routing import DatabaseRouter
+from ingest_profile import setup_logging
+from marker_snapshot import publish_snapshot
+
+log = logging.getLogger(__name__)
+
+LIVE_TABLE = "markers"
+# Retired generations kept for rollback by garbage collection.
+KEEP_RETIRED = 1
+# How long the swap may wait for the lock on the live table per attempt, and
+# how many attempts are made. While the swap waits, every new query on the
+# table queues behind it, so each wait is kept short: a reader holding the table
+# (e.g. a long /export) makes the attempt give up after SWAP_LOCK_TIMEOUT, and
+# the swap backs off for a random time of up to SWAP_BACKOFF * 2^attempt
+# seconds (at most SWAP_BACKOFF_MAX) before trying again.
+SWAP_LOCK_TIMEOUT = "150ms"
+SWAP_ATTEMPTS = 40
+SWAP_BACKOFF = 0.1
+SWAP_BACKOFF_MAX = 5.0
+
+# Session-local table that a load fills in file order before the generation
+# table is written from it in capture-time order.
+STAGING_TABLE = "markers_staging"
+
+CREATE_GENERATION_TABLE_QUERY = """
+CREATE TABLE {table} (
+    id SERIAL PRIMARY KEY,
+    label TEXT,
+    score REAL,
+    geom geometry(Point,4326),
+    bounding_box geometry(Polygon,4326),
+    projection_path TEXT,
+    detection_path TEXT,
+    crop_path TEXT,
+    depth_path TEXT,
+    source_path TEXT,            -- Equirectangular image path from source->path
+    gps_img_direction REAL,      -- GPSImgDirection from source metadata
+    object_depth REAL,           -- Estimated object depth (meters) from objects->object_idx->depth
+    object_relative_angle REAL,  -- Object relative angle from objects->object_idx->relative_angle
+    captured_at TIMESTAMPTZ      -- Panorama capture time from GPSDateStamp + GPSTimeStamp (UTC)
+);
+"""
+
+# The staging table only has the loaded columns: no id, and no constraints
+# (LIKE ... EXCLUDING ALL would still copy the NOT NULL of id).
+CREATE_STAGING_QUERY = "CREATE TEMPORARY TABLE {staging} AS SELECT {columns} FROM {table} WITH NO DATA;"
+STAGING_INSERT_QUERY = "INSERT INTO {staging} ({columns}) VALUES %s;"
+STAGING_COPY_QUERY = """
+INSERT INTO {table} ({columns})
+SELECT {columns} FROM {staging}
+ORDER BY captured_at NULLS LAST;
+"""
+DROP_STAGING_QUERY = "DROP TABLE {staging};"
+
+CREATE_REGISTRY_QUERY = """
+CREATE TABLE IF NOT EXISTS marker_generations (
+    generation TEXT PRIMARY KEY,
+    status TEXT NOT NULL,        -- loading, live or retired
+    marker_count INTEGER,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    swapped_at TIMESTAMPTZ
+);
+"""
+
+
+def new_generation():
+    """Return a new generation identifier (UTC timestamp digits)."""
+    return time.strftime("%Y%m%d%H%M%S", time.gmtime())
+
+
+def generation_table(generation):
+    """Name of the table holding a generation while it is not live."""
+    return f"{LIVE_TABLE}_{generation}"
+
+
+def load_queries(table, columns):
+    """
+    SQL of a load into the generation table `table` through the staging table,
+    for the loaded `columns` (ids are assigned by the generation table).
+    Returns a dict of sql.Composed: 'create' (generation table),
+    'create_staging', 'insert' (one execute_values page into staging), 'copy'
+    (staging into the table in capture-time order) and 'drop_staging'.
+    """
+    identifiers = {
+        "table": sql.Identifier(table),
+        "staging": sql.Identifier(STAGING_TABLE),
+        "columns": sql.SQL(", ").join(map(sql.Identifier, columns)),
+    }
+    return {
+        name: sql.SQL(query).format(**identifiers)
+        for name, query in (
+            ("create", CREATE_GENERATION_TABLE_QUERY),
+            ("create_staging", CREATE_STAGING_QUERY),
+            ("insert", STAGING_INSERT_QUERY),
+            ("copy", STAGING_COPY_QUERY),
+            ("drop_staging", DROP_STAGING_QUERY),
+        )
+    }
+
+
+def ensure_registry(conn):
+    """Create the generation registry, registering a pre-existing markers table as 'legacy'."""
+    with conn.cursor() as cur:
+        cur.execute(CREATE_REGISTRY_QUERY)
+        cur.execute("SELECT to_regclass(%s) IS NOT NULL;", (LIVE_TABLE,))
+        live_exists = cur.fetchone()[0]
+        cur.execute("SELECT count(*) FROM marker_generations WHERE status = 'live';")
+        if live_exists and cur.fetchone()[0] == 0:
+            cur.execute(
+                "INSERT INTO marker_generations (generation, status) VALUES ('legacy', 'live') "
+                "ON CONFLICT (generation) DO UPDATE SET status = 'live';"
+            )
+    conn.commit()
+
+
+def register_loading(conn, generation):
+    with conn.cursor() as cur:
+        cur.execute(
+            "INSERT INTO marker_generations (generation, status) VALUES (%s, 'loading');",
+            (generation,)
+        )
+    conn.commit()
+
+
+def finish_loading(conn, generation):
+    """Run ANALYZE on a loaded generation and record its row count."""
+    table = sql.Identifier(generation_table(generation))
+    with conn.cursor() as cur:
+        cur.execute(sql.SQL("ANALYZE {};").format(table))
+        cur.execute(sql.SQL("SELECT count(*) FROM {};").format(table))
+        count = cur.fetchone()[0]
+        cur.execute(
+            "UPDATE marker_generations SET marker_count = %s WHERE generation = %s;",
+            (count, generation)
+        )
+    conn.commit()
+    return count
+
+
+def live_generation(conn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT generation FROM marker_generations WHERE status = 'live';")
+        row = cur.fetchone()
+    return row[0] if row else None
+
+
+def swap_in(conn, generation):
+    """
+    Make `generation` the live markers table in one short transaction.
+    The previously live generation is retired under its own table name.
+    New queries on the live table may wait up to SWAP_LOCK_TIMEOUT per attempt.
+    """
+    previous = live_generation(conn)
+    for attempt in range(1, SWAP_ATTEMPTS + 1):
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SET LOCAL lock_timeout = %s;", (SWAP_LOCK_TIMEOUT,))
+                if previous is not None:
+                    cur.execute(sql.SQL("LOCK TABLE {} IN ACCESS EXCLUSIVE MODE;").format(sql.Identifier(LIVE_TABLE)))
+                    cur.execute(sql.SQL("ALTER TABLE {} RENAME TO {};").format(
+                        sql.Identifier(LIVE_TABLE), sql.Identifier(generation_table(previous))))
+                    cur.execute(
+                        "UPDATE marker_generations SET status = 'retired' WHERE generation = %s;",
+                        (previous,)
+                    )
+                cur.execute(sql.SQL("ALTER TABLE {} RENAME TO {};").format(
+                    sql.Identifier(generation_table(generation)), sql.Identifier(LIVE_TABLE)))
+                cur.execute(
+                    "UPDATE marker_generations SET status = 'live', swapped_at = now() WHERE generation = %s;",
+                    (generation,)
+                )
+            conn.commit()
+            return previous
+        except errors.LockNotAvailable:
+            conn.rollback()
+            log.warning("Live table busy, retrying swap (%d/%d)...", attempt, SWAP_ATTEMPTS)
+            time.sleep(random.uniform(0, min(SWAP_BACKOFF * 2 ** attempt, SWAP_BACKOFF_MAX)))
+    raise RuntimeError(f"Could not acquire the lock on '{LIVE_TABLE}' to swap in generation {generation}.")
+
+
+def rollback(conn, snapshot_dir=None):
+    """
+    Swap the most recent retired generation back in. Returns its identifier.
+    With snapshot_dir, a snapshot of the restored table is then published
+    there; the rollback stands even if publishing fails.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT generation FROM marker_generations WHERE status = 'retired' "
+            "ORDER BY swapped_at DESC NULLS LAST, created_at DESC LIMIT 1;"
+        )
+        row = cur.fetchone()
+    if row is None:
+        raise RuntimeError("No retired generation to roll back to.")
+    swap_in(conn, row[0])
+    if snapshot_dir:
+        try:
+            name, count = publish_snapshot(conn, snapshot_dir, row[0])
+            log.info("Published marker snapshot %s (%d markers) to %s.", name, count, snapshot_dir)
+        except Exception as e:
+            conn.rollback()
+            log.error("Error publishing marker snapshot: %s", e)
+    return row[0]
+
+
+def drop_generation(conn, generation):
+    with conn.cursor() as cur:
+        cur.execute(sql.SQL("DROP TABLE IF EXISTS {};").format(sql.Identifier(generation_table(generation))))
+        cur.execute("DELETE FROM marker_generations WHERE generation = %s;", (generation,))
+    conn.commit()
+
+
+def garbage_collect(conn, keep=KEEP_RETIRED, exclude=()):
+    """
+    Drop retired generations beyond the `keep` most recent ones, and leftovers
+    of loads that never went live (except those in `exclude`).
+    Returns the dropped generations.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT generation, status FROM marker_generations WHERE status <> 'live' "
+            "ORDER BY swapped_at DESC NULLS LAST, created_at DESC;"
+        )
+        rows = cur.fetchall()
+    retired = [generation for generation, status in rows if status == 'retired']
+    stale = [generation for generation, status in rows if status == 'loading' and generation not in exclude]
+    dropped = retired[keep:] + stale
+    for generation in dropped:
+        drop_generation(conn, generation)
+    return dropped
+
+
+def list_generations(conn):
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT generation, status, marker_count, created_at, swapped_at "
+            "FROM marker_generations ORDER BY created_at;"
+        )
+        return cur.fetchall()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in ("list", "rollback", "gc"):
+        print(__doc__)
+        sys.exit(1)
+    load_dotenv()
+    setup_logging("table_generations")
+    conn = DatabaseRouter.from_env().connect()
+    try:
+        ensure_registry(conn)
+        if sys.argv[1] == "list":
+            for generation, status, count, created_at, swapped_at in list_generations(conn):
+                print(f"{generation:<16} {status:<8} {count if count is not None else '-':>10}  created {created_at}  swapped {swapped_at}")
+        elif sys.argv[1] == "rollback":
+            print(f"[INFO] Generation {rollback(conn, os.environ.get('MARKER_SNAPSHOT_DIR'))} is live again.")
+        else:
+            keep = int(sys.argv[2]) if len(sys.argv) > 2 else KEEP_RETIRED
+            print(f"[INFO] Dropped generations: {garbage_collect(conn, keep)}")
+    finally:
+        conn.close()
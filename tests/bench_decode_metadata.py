@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of metadata decoding for ingest.
+
+Replicates the sample metadata in data/ into a temporary tree of *_metadata.json
+files and measures the per-object decode cost of:
+  - the legacy path (stdlib json, per-value float() DMS conversion and f-string
+    debug prints, WKT built per object), as generate_db.py did it before;
+  - the vectorized decoder in src/decode_metadata.py, with WKT and WKB output.
+
+Usage: python tests/bench_decode_metadata.py [number_of_files] [repeats]
+"""
+
+import os
+import sys
+import json
+import glob
+import shutil
+import tempfile
+import contextlib
+import time
+
+ROOT_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT_DIR, "src"))
+
+from decode_metadata import find_metadata_files, iter_file_batches, decode_metadata_files
+
+
+def legacy_convert_dms_to_decimal(dms, ref):
+    """Copy of the original per-value conversion from generate_db.py."""
+    try:
+        degrees = float(dms.get("degrees", 0))
+        minutes = float(dms.get("minutes", 0))
+        seconds = float(dms.get("seconds", 0))
+    except Exception as e:
+        print(f"[DEBUG] Error converting DMS values: {e}")
+        raise e
+    decimal = degrees + minutes / 60 + seconds / 3600
+    if ref in ['S', 'W']:
+        decimal = -decimal
+    print(f"[DEBUG] Converted DMS {dms} with ref '{ref}' to decimal: {decimal}")
+    return decimal
+
+
+def legacy_decode(filepaths):
+    """Original load_markers_from_metadata + record preparation, condensed."""
+    records = []
+    for filepath in filepaths:
+        print(f"[DEBUG] Processing file: {filepath}")
+        with open(filepath, "r") as f:
+            meta = json.load(f)
+        source_info = meta.get("source", {})
+        for obj in meta.get("objects", []):
+            label_str = " ".join(obj.get("label", "").split()).lower()
+            if label_str == "electricity management box":
+                print(f"[DEBUG] Skipping object with label 'electricity management box' in {filepath}.")
+                continue
+            comp = obj.get("computed_location", {})
+            try:
+                decimal_lat = legacy_convert_dms_to_decimal(comp.get("GPSLatitude", {}), comp.get("GPSLatitudeRef", "N"))
+                decimal_lon = legacy_convert_dms_to_decimal(comp.get("GPSLongitude", {}), comp.get("GPSLongitudeRef", "E"))
+            except Exception:
+                continue
+            bbox_wkt = None
+            bb = obj.get("bounding_box")
+            if bb:
+                xmin, ymin = float(bb.get("xmin")), float(bb.get("ymin"))
+                xmax, ymax = float(bb.get("xmax")), float(bb.get("ymax"))
+                bbox_wkt = f'SRID=4326;POLYGON(({xmin} {ymin}, {xmax} {ymin}, {xmax} {ymax}, {xmin} {ymax}, {xmin} {ymin}))'
+                print(f"[DEBUG] Using bounding_box WKT: {bbox_wkt}")
+            record = (
+                obj.get("label", "Unknown").strip(),
+                obj.get("score", 0.0),
+                f'SRID=4326;POINT({decimal_lon} {decimal_lat})',
+                bbox_wkt,
+                obj.get("projection_path", ""),
+                obj.get("detection_path", obj.get("projection_path", "")),
+                obj.get("crop_path", ""),
+                obj.get("depth_path", ""),
+                source_info.get("path", ""),
+                source_info.get("GPSImgDirection", 0.0),
+                obj.get("depth", 0.0),
+                obj.get("relative_angle", 0.0),
+            )
+            print("[DEBUG] Prepared record:", record)
+            records.append(record)
+    return records
+
+
+def vectorized_decode(filepaths, geom_format, batch_size=500):
+    records = []
+    for batch in iter_file_batches(filepaths, batch_size):
+        batch_records, _, _ = decode_metadata_files(batch, geom_format)
+        records.extend(batch_records)
+    return records
+
+
+def build_sample_tree(target_dir, n_files):
+    samples = sorted(glob.glob(os.path.join(ROOT_DIR, "data", "*.json")))
+    for i in range(n_files):
+        subdir = os.path.join(target_dir, f"seq{i // 1000:03d}")
+        os.makedirs(subdir, exist_ok=True)
+        shutil.copyfile(samples[i % len(samples)], os.path.join(subdir, f"img{i:06d}_metadata.json"))
+
+
+def best_time(fn, repeats):
+    best, result = None, None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+if __name__ == "__main__":
+    n_files = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    tmp_dir = tempfile.mkdtemp(prefix="bench_decode_")
+    try:
+        build_sample_tree(tmp_dir, n_files)
+        filepaths = find_metadata_files(tmp_dir)
+
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            legacy_time, legacy_records = best_time(lambda: legacy_decode(filepaths), repeats)
+        n_objects = len(legacy_records)
+
+        print(f"Decoding {n_objects} objects from {len(filepaths)} files (best of {repeats}):")
+        print(f"  {'legacy (json + per-value float + debug prints)':<48} {legacy_time * 1e6 / n_objects:8.2f} us/object")
+        for geom_format in ("wkt", "wkb"):
+            elapsed, records = best_time(lambda: vectorized_decode(filepaths, geom_format), repeats)
+            assert len(records) == n_objects, "decoders disagree on the number of records"
+            print(f"  {'vectorized (' + geom_format + ')':<48} {elapsed * 1e6 / n_objects:8.2f} us/object"
+                  f"   x{legacy_time / elapsed:.1f}")
+    finally:
+        shutil.rmtree(tmp_dir)
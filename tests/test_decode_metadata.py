@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Parity checks of the vectorized metadata decoder against the scalar reference.
+
+Every object of the sample metadata in data/ is decoded by decode_metadata (WKT
+and WKB output) and compared with the per-object path: convert_dms_to_decimal
+for the coordinates, and the bounding box corners for the polygon. WKB output
+is decoded back from hex EWKB.
+
+Usage: python -m pytest tests/test_decode_metadata.py
+"""
+
+import os
+import re
+import sys
+import glob
+import json
+import struct
+
+ROOT_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT_DIR, "src"))
+
+from decode_metadata import (
+    MARKER_COLUMNS, SKIPPED_LABELS, SRID, EWKB_SRID_FLAG,
+    convert_dms_to_decimal, decode_metadata, decode_metadata_files,
+)
+
+TOLERANCE = 1e-9
+GEOM = MARKER_COLUMNS.index("geom")
+BOUNDING_BOX = MARKER_COLUMNS.index("bounding_box")
+CAPTURED_AT = MARKER_COLUMNS.index("captured_at")
+SAMPLE_FILES = sorted(glob.glob(os.path.join(ROOT_DIR, "data", "*.json")))
+
+
+def load_samples():
+    metas = []
+    for filepath in SAMPLE_FILES:
+        with open(filepath) as f:
+            metas.append(json.load(f))
+    return metas
+
+
+def reference_objects(metas):
+    """(lon, lat, ring or None, source) of every kept object, computed one by one."""
+    expected = []
+    for meta in metas:
+        for obj in meta.get("objects", []):
+            if " ".join(obj.get("label", "").split()).lower() in SKIPPED_LABELS:
+                continue
+            comp = obj.get("computed_location", {})
+            lat = convert_dms_to_decimal(comp.get("GPSLatitude", {}), comp.get("GPSLatitudeRef", "N"))
+            lon = convert_dms_to_decimal(comp.get("GPSLongitude", {}), comp.get("GPSLongitudeRef", "E"))
+            ring = None
+            bb = obj.get("bounding_box")
+            if bb:
+                xmin, ymin = float(bb["xmin"]), float(bb["ymin"])
+                xmax, ymax = float(bb["xmax"]), float(bb["ymax"])
+                ring = [(xmin, ymin), (xmax, ymin), (xmax, ymax), (xmin, ymax), (xmin, ymin)]
+            expected.append((lon, lat, ring, meta.get("source", {})))
+    return expected
+
+
+def parse_ewkt(text):
+    """Coordinates of an EWKT point or single-ring polygon."""
+    assert text.startswith(f"SRID={SRID};")
+    numbers = [float(v) for v in re.findall(r"-?[\d.]+(?:e-?\d+)?", text.split(";", 1)[1])]
+    return list(zip(numbers[0::2], numbers[1::2]))
+
+
+def parse_ewkb(hexed):
+    """Geometry type and coordinates of a little-endian hex EWKB point or single-ring polygon."""
+    data = bytes.fromhex(hexed)
+    order, geom_type, srid = struct.unpack_from("<BII", data, 0)
+    assert order == 1 and srid == SRID and geom_type & EWKB_SRID_FLAG
+    geom_type &= ~EWKB_SRID_FLAG
+    if geom_type == 1:
+        return 1, [struct.unpack_from("<2d", data, 9)]
+    rings, npoints = struct.unpack_from("<II", data, 9)
+    assert rings == 1 and len(data) == 17 + 16 * npoints
+    return geom_type, [struct.unpack_from("<2d", data, 17 + 16 * i) for i in range(npoints)]
+
+
+def assert_close(actual, expected):
+    assert len(actual) == len(expected)
+    for (x, y), (ex, ey) in zip(actual, expected):
+        assert abs(x - ex) < TOLERANCE and abs(y - ey) < TOLERANCE, (x, y, ex, ey)
+
+
+def test_samples_present():
+    assert SAMPLE_FILES, "no sample metadata in data/"
+    assert reference_objects(load_samples()), "no decodable objects in the sample metadata"
+
+
+def test_wkt_matches_reference():
+    metas = load_samples()
+    expected = reference_objects(metas)
+    records, _ = decode_metadata(metas, "wkt")
+    assert len(records) == len(expected)
+    for record, (lon, lat, ring, source) in zip(records, expected):
+        assert_close(parse_ewkt(record[GEOM]), [(lon, lat)])
+        if ring is None:
+            assert record[BOUNDING_BOX] is None
+        else:
+            assert_close(parse_ewkt(record[BOUNDING_BOX]), ring)
+        assert record[MARKER_COLUMNS.index("source_path")] == source.get("path", "")
+
+
+def test_wkb_matches_reference():
+    metas = load_samples()
+    expected = reference_objects(metas)
+    records, _ = decode_metadata(metas, "wkb")
+    assert len(records) == len(expected)
+    for record, (lon, lat, ring, _) in zip(records, expected):
+        geom_type, coords = parse_ewkb(record[GEOM])
+        assert geom_type == 1
+        assert_close(coords, [(lon, lat)])
+        if ring is None:
+            assert record[BOUNDING_BOX] is None
+        else:
+            geom_type, coords = parse_ewkb(record[BOUNDING_BOX])
+            assert geom_type == 3
+            assert_close(coords, ring)
+
+
+def test_formats_agree_on_attributes():
+    metas = load_samples()
+    wkt, wkt_skipped = decode_metadata(metas, "wkt")
+    wkb, wkb_skipped = decode_metadata(metas, "wkb")
+    assert wkt_skipped == wkb_skipped
+    geometry_columns = (GEOM, BOUNDING_BOX)
+    for a, b in zip(wkt, wkb):
+        assert [v for i, v in enumerate(a) if i not in geometry_columns] == \
+               [v for i, v in enumerate(b) if i not in geometry_columns]
+
+
+def test_capture_time():
+    metas = load_samples()
+    records, _ = decode_metadata(metas, "wkt")
+    i = 0
+    for meta in metas:
+        gps = meta["source"].get("GPS_metadata", {})
+        stamp = gps["GPSTimeStamp"]
+        expected = "{}T{:02d}:{:02d}:{:02d}.000Z".format(
+            gps["GPSDateStamp"].replace(":", "-"),
+            int(stamp["hour"]), int(stamp["minute"]), int(stamp["second"])
+        )
+        for obj in meta.get("objects", []):
+            if " ".join(obj.get("label", "").split()).lower() in SKIPPED_LABELS:
+                continue
+            assert records[i][CAPTURED_AT] == expected
+            i += 1
+
+
+def test_files_match_in_memory_decode():
+    records, skipped, failed = decode_metadata_files(SAMPLE_FILES, "wkb")
+    assert not failed
+    assert (records, skipped) == decode_metadata(load_samples(), "wkb")
+
+
+def test_unlocated_objects_are_skipped():
+    meta = load_samples()[0]
+    obj = dict(next(o for o in meta["objects"]
+                    if " ".join(o.get("label", "").split()).lower() not in SKIPPED_LABELS))
+    obj["computed_location"] = {"GPSLatitude": {"degrees": "n/a"}, "GPSLongitude": {}}
+    records, skipped = decode_metadata([{"source": meta["source"], "objects": [obj]}], "wkt")
+    assert records == [] and skipped == 1
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Round trip of the FlatGeobuf writer through an independent reader.
+
+The files written by fgb_writer.py are decoded with the small FlatBuffers
+reader below, which follows the FlatGeobuf schema (header.fbs, feature.fbs):
+header, CRS, columns, point coordinates and sparse properties are compared with
+what was written. When pyogrio is installed, GDAL reads the same file too.
+
+Usage: python -m pytest tests/test_fgb_writer.py
+"""
+
+import os
+import sys
+import struct
+
+import pytest
+
+ROOT_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT_DIR, "src"))
+
+from fgb_writer import MAGIC, COLUMN_TYPES, iter_flatgeobuf, encode_point_feature, encode_properties, _build_point_feature
+
+COLUMNS = [
+    ("id", "int"), ("count", "long"), ("score", "float"), ("depth", "double"),
+    ("label", "string"), ("captured_at", "datetime"),
+]
+FEATURES = [
+    (5.7245, 45.1885, [1, 2 ** 40, 0.5, 12.25, "utility pole", "2024-07-01T10:00:00+00:00"]),
+    (-122.4194155, 37.7749295, [2, None, None, 3.5, "bench", None]),
+    (179.999999999, -89.5, [3, -7, 0.125, None, "réverbère ☃", "2024-07-02T00:00:00Z"]),
+    (0.0, 0.0, [None, None, None, None, None, None]),
+    (1e-9, -1e-9, [None, None, None, None, "", None]),
+]
+
+
+class Table:
+    """FlatBuffers table at position pos of buf."""
+
+    def __init__(self, buf, pos):
+        self.buf = buf
+        self.pos = pos
+        self.vtable = pos - struct.unpack_from("<i", buf, pos)[0]
+        self.vtable_size = struct.unpack_from("<H", buf, self.vtable)[0]
+
+    def field(self, field_id):
+        """Position of a field, or None if absent."""
+        slot = 4 + 2 * field_id
+        if slot >= self.vtable_size:
+            return None
+        offset = struct.unpack_from("<H", self.buf, self.vtable + slot)[0]
+        return self.pos + offset if offset else None
+
+    def scalar(self, field_id, fmt, default=None):
+        pos = self.field(field_id)
+        return default if pos is None else struct.unpack_from("<" + fmt, self.buf, pos)[0]
+
+    def ref(self, field_id):
+        pos = self.field(field_id)
+        return None if pos is None else pos + struct.unpack_from("<I", self.buf, pos)[0]
+
+    def table(self, field_id):
+        pos = self.ref(field_id)
+        return None if pos is None else Table(self.buf, pos)
+
+    def string(self, field_id):
+        pos = self.ref(field_id)
+        if pos is None:
+            return None
+        length = struct.unpack_from("<I", self.buf, pos)[0]
+        return self.buf[pos + 4:pos + 4 + length].decode()
+
+    def vector(self, field_id):
+        """(start, length) of a vector field."""
+        pos = self.ref(field_id)
+        if pos is None:
+            return None
+        return pos + 4, struct.unpack_from("<I", self.buf, pos)[0]
+
+    def tables(self, field_id):
+        start, length = self.vector(field_id)
+        return [Table(self.buf, start + 4 * i + struct.unpack_from("<I", self.buf, start + 4 * i)[0])
+                for i in range(length)]
+
+
+def read_flatgeobuf(data):
+    """Decode a FlatGeobuf file of point features: (header dict, [(x, y, values)])."""
+    assert data[:len(MAGIC)] == MAGIC
+    pos = len(MAGIC)
+    size = struct.unpack_from("<I", data, pos)[0]
+    root = data[pos + 4:pos + 4 + size]
+    header = Table(root, struct.unpack_from("<I", root, 0)[0])
+    columns = [(c.string(0), c.scalar(1, "B", 0)) for c in header.tables(7)]
+    crs = header.table(10)
+    info = {
+        "name": header.string(0),
+        "geometry_type": header.scalar(2, "B", 0),
+        "columns": columns,
+        "features_count": header.scalar(8, "Q", 0),
+        # The schema default is 16: the writer must set 0 explicitly.
+        "index_node_size": header.scalar(9, "H", 16),
+        "crs": (crs.string(0), crs.scalar(1, "i", 0)),
+    }
+    pos += 4 + size
+
+    features = []
+    while pos < len(data):
+        size = struct.unpack_from("<I", data, pos)[0]
+        buf = data[pos + 4:pos + 4 + size]
+        feature = Table(buf, struct.unpack_from("<I", buf, 0)[0])
+        start, length = feature.table(0).vector(1)
+        assert length == 2
+        x, y = struct.unpack_from("<2d", buf, start)
+        values = [None] * len(columns)
+        properties = feature.vector(1)
+        if properties is not None:
+            start, length = properties
+            offset, end = start, start + length
+            while offset < end:
+                index = struct.unpack_from("<H", buf, offset)[0]
+                offset += 2
+                column_type = columns[index][1]
+                fmt = {5: "<i", 7: "<q", 9: "<f", 10: "<d"}.get(column_type)
+                if fmt:
+                    values[index] = struct.unpack_from(fmt, buf, offset)[0]
+                    offset += struct.calcsize(fmt)
+                else:
+                    length = struct.unpack_from("<I", buf, offset)[0]
+                    values[index] = buf[offset + 4:offset + 4 + length].decode()
+                    offset += 4 + length
+        features.append((x, y, values))
+        pos += 4 + size
+    return info, features
+
+
+def write(features=FEATURES, columns=COLUMNS):
+    return b"".join(iter_flatgeobuf("markers", columns, features))
+
+
+def test_header():
+    info, _ = read_flatgeobuf(write())
+    assert info == {
+        "name": "markers",
+        "geometry_type": 1,
+        "columns": [(name, COLUMN_TYPES[column_type]) for name, column_type in COLUMNS],
+        "features_count": 0,
+        "index_node_size": 0,
+        "crs": ("EPSG", 4326),
+    }
+
+
+def test_features_round_trip():
+    _, features = read_flatgeobuf(write())
+    assert len(features) == len(FEATURES)
+    for (x, y, values), (ex, ey, expected) in zip(features, FEATURES):
+        assert (x, y) == (ex, ey)
+        # Float columns are stored as 32-bit floats.
+        assert values == [v if column_type != "float" or v is None else struct.unpack("<f", struct.pack("<f", v))[0]
+                          for (_, column_type), v in zip(COLUMNS, expected)]
+
+
+def test_no_features():
+    info, features = read_flatgeobuf(write(features=[]))
+    assert info["name"] == "markers" and features == []
+
+
+def test_sparse_properties_skip_missing_values():
+    encoded = encode_properties(COLUMNS, [None, None, None, None, "a", None])
+    assert encoded == struct.pack("<HI", 4, 1) + b"a"
+    assert encode_properties(COLUMNS, [None] * len(COLUMNS)) == b""
+
+
+@pytest.mark.parametrize("length", range(1, 12))
+def test_template_matches_builder(length):
+    # The byte-patched fast path must produce what the FlatBuffers builder does.
+    properties = bytes(range(1, length + 1))
+    assert encode_point_feature(-3.25, 44.5, properties) == _build_point_feature(-3.25, 44.5, properties)
+
+
+def test_feature_sizes_are_aligned():
+    data = write()
+    pos = len(MAGIC)
+    while pos < len(data):
+        size = struct.unpack_from("<I", data, pos)[0]
+        assert size % 4 == 0
+        pos += 4 + size
+    assert pos == len(data)
+
+
+def test_readable_by_gdal(tmp_path):
+    pyogrio = pytest.importorskip("pyogrio")
+    path = tmp_path / "markers.fgb"
+    path.write_bytes(write())
+    info = pyogrio.read_info(str(path))
+    assert info["crs"] == "EPSG:4326"
+    assert info["geometry_type"] == "Point"
+    assert list(info["fields"]) == [name for name, _ in COLUMNS]
+    _, _, geometry, fields = pyogrio.raw.read(str(path))
+    assert len(geometry) == len(FEATURES)
+    assert fields[4].tolist()[:3] == ["utility pole", "bench", "réverbère ☃"]
+
+
+def test_export_rows_round_trip():
+    # COPY text rows of the "fgb" export query, split across arbitrary chunks.
+    pytest.importorskip("psycopg2")
+    pytest.importorskip("dotenv")
+    from export_markers import FGB_COLUMNS, fgb_features, iter_copy_rows
+
+    copy_output = (
+        b"5.7245\t45.1885\t1\tutility pole\t0.5\t2024-07-01T10:00:00+00:00\tsrc/a.jpg\tp/a.jpg\t\\N\t12.25\n"
+        b"-1.5\t43.25\t2\tline\\tbreak\\\\x\\n\t\\N\t\\N\t\\N\t\\N\t\\N\t\\N\n"
+    )
+    chunks = [copy_output[i:i + 7] for i in range(0, len(copy_output), 7)]
+    data = b"".join(iter_flatgeobuf("markers", FGB_COLUMNS, fgb_features(iter_copy_rows(chunks))))
+    _, features = read_flatgeobuf(data)
+    assert features[0][:2] == (5.7245, 45.1885)
+    assert features[0][2] == [1, "utility pole", 0.5, "2024-07-01T10:00:00+00:00", "src/a.jpg", "p/a.jpg", None, 12.25]
+    assert features[1] == (-1.5, 43.25, [2, "line\tbreak\\x\n", None, None, None, None, None, None])
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Load SQL of generate_db.py against a real PostGIS database.
+
+The sample metadata in data/ is decoded and loaded into a throwaway generation
+table through the staging table exactly as generate_db.py does, in both
+geometry formats, and the loaded rows are checked against the records.
+
+Needs a scratch PostGIS database given as a libpq connection string, e.g.:
+  TEST_DATABASE_URL="host=localhost dbname=geodb user=postgres" python -m pytest tests/test_generation_load.py
+The tests are skipped when it is not set.
+"""
+
+import os
+import sys
+import glob
+import json
+
+import pytest
+
+ROOT_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT_DIR, "src"))
+
+psycopg2 = pytest.importorskip("psycopg2")
+pytest.importorskip("dotenv")
+from psycopg2.extras import execute_values
+
+from decode_metadata import MARKER_COLUMNS, decode_metadata
+from table_generations import STAGING_TABLE, load_queries
+
+DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+pytestmark = pytest.mark.skipif(not DATABASE_URL, reason="TEST_DATABASE_URL is not set")
+
+TABLE = "markers_test_load"
+CAPTURED_AT = MARKER_COLUMNS.index("captured_at")
+
+
+def load_records(geom_format):
+    metas = []
+    for filepath in sorted(glob.glob(os.path.join(ROOT_DIR, "data", "*.json"))):
+        with open(filepath) as f:
+            metas.append(json.load(f))
+    records, _ = decode_metadata(metas, geom_format)
+    return records
+
+
+@pytest.fixture
+def conn():
+    conn = psycopg2.connect(DATABASE_URL)
+    yield conn
+    conn.rollback()
+    with conn.cursor() as cur:
+        cur.execute(f"DROP TABLE IF EXISTS {TABLE};")
+    conn.commit()
+    conn.close()
+
+
+@pytest.mark.parametrize("geom_format", ["wkt", "wkb"])
+def test_load_through_staging(conn, geom_format):
+    records = load_records(geom_format)
+    assert records
+    queries = load_queries(TABLE, MARKER_COLUMNS)
+    with conn.cursor() as cur:
+        cur.execute(queries["create"])
+        cur.execute(queries["create_staging"])
+        conn.commit()
+        # Loaded in two pages, as batches are.
+        half = len(records) // 2
+        execute_values(cur, queries["insert"].as_string(conn), records[:half], page_size=1000)
+        execute_values(cur, queries["insert"].as_string(conn), records[half:], page_size=1000)
+        conn.commit()
+        cur.execute(queries["copy"])
+        cur.execute(queries["drop_staging"])
+        conn.commit()
+
+        cur.execute("SELECT to_regclass(%s) IS NULL;", (STAGING_TABLE,))
+        assert cur.fetchone()[0]
+        cur.execute(f"SELECT id, captured_at, label, source_path, ST_SRID(geom), ST_AsText(geom) FROM {TABLE} ORDER BY id;")
+        rows = cur.fetchall()
+
+    assert len(rows) == len(records)
+    assert [row[0] for row in rows] == list(range(1, len(rows) + 1))
+    # Ids follow capture time, markers without one last.
+    times = [row[1] for row in rows]
+    located = [t for t in times if t is not None]
+    assert located == sorted(located)
+    assert times[:len(located)] == located
+    assert sorted((row[2], row[3]) for row in rows) == sorted(
+        (record[MARKER_COLUMNS.index("label")], record[MARKER_COLUMNS.index("source_path")]) for record in records
+    )
+    assert all(row[4] == 4326 and row[5].startswith("POINT(") for row in rows)
+
+
+def test_staging_has_no_constraints(conn):
+    queries = load_queries(TABLE, MARKER_COLUMNS)
+    with conn.cursor() as cur:
+        cur.execute(queries["create"])
+        cur.execute(queries["create_staging"])
+        cur.execute(
+            "SELECT attname FROM pg_attribute WHERE attrelid = %s::regclass AND attnum > 0 "
+            "AND NOT attisdropped ORDER BY attnum;", (STAGING_TABLE,)
+        )
+        assert [row[0] for row in cur.fetchall()] == list(MARKER_COLUMNS)
+        cur.execute("SELECT count(*) FROM pg_constraint WHERE conrelid = %s::regclass;", (STAGING_TABLE,))
+        assert cur.fetchone()[0] == 0
+        # A row with only NULLs is accepted.
+        cur.execute(queries["insert"].as_string(conn).replace("%s", "(" + ", ".join(["NULL"] * len(MARKER_COLUMNS)) + ")"))
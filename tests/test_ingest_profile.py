@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Per-stage peak memory of IngestProfiler.
+
+Usage: python -m pytest tests/test_ingest_profile.py
+"""
+
+import os
+import sys
+
+import pytest
+
+ROOT_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT_DIR, "src"))
+
+from ingest_profile import IngestProfiler, reset_peak_rss, high_water_rss_bytes
+
+MB = 1 << 20
+
+pytestmark = pytest.mark.skipif(
+    not (reset_peak_rss() and high_water_rss_bytes()), reason="per-stage peak memory needs Linux /proc"
+)
+
+
+def allocate(size):
+    block = bytearray(size)
+    # Touch every page so it is resident.
+    block[::4096] = b"\1" * len(block[::4096])
+    del block
+
+
+def test_interleaved_stages_get_their_own_peak(tmp_path):
+    profiler = IngestProfiler("test", report_path=str(tmp_path / "report.json"))
+    profiler.start()
+    for _ in range(3):
+        with profiler.stage("large"):
+            allocate(300 * MB)
+        with profiler.stage("small"):
+            allocate(10 * MB)
+    stages = profiler.finish()["stages"]
+    assert stages["large"]["peak_rss_bytes"] - stages["small"]["peak_rss_bytes"] > 200 * MB
+
+
+def test_enclosing_stage_keeps_its_peak(tmp_path):
+    profiler = IngestProfiler("test", report_path=str(tmp_path / "report.json"))
+    profiler.start()
+    with profiler.stage("outer"):
+        allocate(300 * MB)
+        with profiler.stage("inner"):
+            pass
+    report = profiler.finish()
+    stages = report["stages"]
+    assert stages["outer"]["peak_rss_bytes"] - stages["inner"]["peak_rss_bytes"] > 200 * MB
+    assert report["peak_rss_bytes"] >= stages["outer"]["peak_rss_bytes"]
+
+
+def test_disabled_profiler_does_not_measure():
+    profiler = IngestProfiler("test")
+    with profiler.stage("stage"):
+        pass
+    assert profiler.stages["stage"].peak_rss is None
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Parsing of the filter parameters shared by the routes and the command line tools.
+
+Usage: python -m pytest tests/test_marker_filters.py
+"""
+
+import os
+import sys
+
+import pytest
+
+ROOT_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT_DIR, "src"))
+
+from marker_filters import parse_bbox, bbox_clause
+
+
+def test_parse_bbox():
+    assert parse_bbox("45.1", "5.7", "45.2", " 5.8 ") == (45.1, 5.7, 45.2, 5.8)
+    assert parse_bbox(-90, -180, 90, 180) == (-90.0, -180.0, 90.0, 180.0)
+
+
+@pytest.mark.parametrize("values", [
+    ("nan", "5.7", "45.2", "5.8"),
+    ("45.1", "inf", "45.2", "5.8"),
+    ("45.1", "5.7", "-Infinity", "5.8"),
+    ("45.1", "5.7", "45.2", "NaN"),
+    ("45.1", "5.7", "45.2", "1e400"),
+    ("45.1", "5.7", "45.2", "east"),
+])
+def test_parse_bbox_rejects_non_finite_values(values):
+    with pytest.raises(ValueError):
+        parse_bbox(*values)
+
+
+def test_parse_bbox_rejects_missing_values():
+    with pytest.raises(TypeError):
+        parse_bbox("45.1", None, "45.2", "5.8")
+
+
+def test_bbox_clause():
+    assert bbox_clause(None) == ("", [])
+    clause, params = bbox_clause((45.1, 5.7, 45.2, 5.8))
+    assert clause == " AND geom && ST_MakeEnvelope(%s, %s, %s, %s, 4326)"
+    assert params == [5.7, 45.1, 5.8, 45.2]
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Checks of the in-memory marker snapshot against brute force.
+
+A snapshot is written from random rows, then bbox/label/time queries are
+compared with a mask over all rows, /markers JSON with the rows themselves, and
+clusters with single-linkage over all pairs of points (as ST_ClusterWithin).
+
+Usage: python -m pytest tests/test_marker_snapshot.py
+"""
+
+import os
+import sys
+import json
+import math
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+
+ROOT_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT_DIR, "src"))
+
+# marker_snapshot reads from the database through psycopg2.
+pytest.importorskip("psycopg2")
+pytest.importorskip("dotenv")
+import marker_snapshot
+from marker_snapshot import MarkerSnapshot, write_snapshot, link_points, cluster_points
+
+LABELS = ("bench", "hydrant", "sign", "tree")
+START = datetime(2024, 5, 1, tzinfo=timezone.utc)
+
+
+def random_rows(n, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = []
+    for i in range(n):
+        lon = round(float(rng.uniform(2.30, 2.40)), 7)
+        lat = round(float(rng.uniform(48.80, 48.90)), 7)
+        captured = START + timedelta(minutes=int(rng.integers(0, 60 * 24 * 30)))
+        rows.append({
+            "id": i + 1,
+            "label": LABELS[int(rng.integers(len(LABELS)))] if i % 17 else None,
+            "score": round(float(rng.uniform()), 3) if i % 11 else None,
+            "projection_path": f"proj/{i}.jpg",
+            "detection_path": f"det/{i}.jpg",
+            "crop_path": None,
+            "depth_path": f"depth/{i}.png",
+            "source_path": f"src/{i // 4}.jpg",
+            "object_depth": float(rng.uniform(1, 30)),
+            "captured_at": captured if i % 13 else None,
+            "geom": json.dumps({"type": "Point", "coordinates": [lon, lat]}),
+            "bounding_box": None,
+            "lon": lon,
+            "lat": lat,
+        })
+    return rows
+
+
+@pytest.fixture(scope="module")
+def snapshot(tmp_path_factory):
+    rows = random_rows(3000)
+    path = str(tmp_path_factory.mktemp("snap") / "markers-test.snap")
+    assert write_snapshot(path, rows, "test") == len(rows)
+    return MarkerSnapshot(path), rows
+
+
+def brute_force_ids(rows, bbox, categories=None, time_from=None, time_to=None):
+    minlat, minlon, maxlat, maxlon = bbox
+    ids = set()
+    for row in rows:
+        if not (minlon <= row["lon"] <= maxlon and minlat <= row["lat"] <= maxlat):
+            continue
+        if categories is not None and row["label"] not in categories:
+            continue
+        if time_from is not None or time_to is not None:
+            if row["captured_at"] is None:
+                continue
+            if time_from is not None and row["captured_at"] < time_from:
+                continue
+            if time_to is not None and row["captured_at"] >= time_to:
+                continue
+        ids.add(row["id"])
+    return ids
+
+
+def brute_force_labels(lon, lat, distance):
+    """Component of every point, linking all pairs within distance."""
+    parent = list(range(len(lon)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    close = (lon[:, None] - lon[None, :]) ** 2 + (lat[:, None] - lat[None, :]) ** 2 <= distance * distance
+    for i, j in zip(*np.nonzero(close)):
+        parent[find(i)] = find(j)
+    return np.array([find(i) for i in range(len(lon))])
+
+
+def same_partition(a, b):
+    return len(set(zip(a.tolist(), b.tolist()))) == len(set(a.tolist())) == len(set(b.tolist()))
+
+
+BBOXES = [
+    (48.80, 2.30, 48.90, 2.40),
+    (48.83, 2.31, 48.86, 2.37),
+    (48.8512, 2.3333, 48.8513, 2.3334),
+    (48.95, 2.30, 49.00, 2.40),
+]
+
+
+@pytest.mark.parametrize("bbox", BBOXES)
+def test_query_bbox(snapshot, bbox):
+    snap, rows = snapshot
+    idx = snap.query(*bbox)
+    assert np.all(np.diff(idx) > 0)
+    assert set(snap.id[idx].tolist()) == brute_force_ids(rows, bbox)
+
+
+def test_query_bounds_included(snapshot):
+    snap, rows = snapshot
+    row = rows[42]
+    bbox = (row["lat"], row["lon"], row["lat"], row["lon"])
+    assert row["id"] in set(snap.id[snap.query(*bbox)].tolist())
+
+
+@pytest.mark.parametrize("bbox", BBOXES[:2])
+def test_query_filters(snapshot, bbox):
+    snap, rows = snapshot
+    categories = ["hydrant", "tree", "unknown"]
+    time_from, time_to = START + timedelta(days=5), START + timedelta(days=12)
+    idx = snap.query(*bbox, label_ids=snap.label_ids(categories))
+    assert set(snap.id[idx].tolist()) == brute_force_ids(rows, bbox, categories)
+    idx = snap.query(*bbox, time_from=time_from, time_to=time_to)
+    assert set(snap.id[idx].tolist()) == brute_force_ids(rows, bbox, None, time_from, time_to)
+    idx = snap.query(*bbox, label_ids=snap.label_ids(categories), time_from=time_from)
+    assert set(snap.id[idx].tolist()) == brute_force_ids(rows, bbox, categories, time_from)
+
+
+@pytest.mark.parametrize("bbox", BBOXES)
+def test_markers_json(snapshot, bbox):
+    snap, rows = snapshot
+    by_id = {row["id"]: row for row in rows}
+    markers = json.loads(snap.markers_json(snap.query(*bbox)))
+    assert {m["id"] for m in markers} == brute_force_ids(rows, bbox)
+    for marker in markers:
+        row = by_id[marker["id"]]
+        assert set(marker) == set(marker_snapshot.ROW_COLUMNS)
+        for key in marker_snapshot.ROW_COLUMNS:
+            if key == "captured_at":
+                expected = row[key] and marker_snapshot._json_default(row[key])
+                assert marker[key] == expected
+            else:
+                assert marker[key] == row[key]
+
+
+def test_markers_json_subset(snapshot):
+    snap, rows = snapshot
+    idx = snap.query(*BBOXES[0])[::7]
+    assert [m["id"] for m in json.loads(snap.markers_json(idx))] == snap.id[idx].tolist()
+    assert snap.markers_json(idx[:0]) == b"[]"
+
+
+@pytest.mark.parametrize("seed", range(6))
+@pytest.mark.parametrize("distance", [0.0, 0.002, 0.01, 0.03, 0.08, 0.5])
+def test_link_points_matches_brute_force(seed, distance):
+    rng = np.random.default_rng(seed)
+    n = 400
+    lon, lat = rng.uniform(0, 1, n), rng.uniform(0, 1, n)
+    if seed % 2:
+        # Snapped to a coarse grid: duplicates and pairs exactly at the distance.
+        lon, lat = np.round(lon * 50) / 50, np.round(lat * 50) / 50
+    labels, exact = link_points(lon, lat, distance)
+    assert exact
+    assert same_partition(labels, brute_force_labels(lon, lat, distance))
+
+
+def test_link_points_dense():
+    rng = np.random.default_rng(7)
+    lon = np.concatenate([rng.normal(0.5, 0.01, 600), rng.uniform(0, 1, 200)])
+    lat = np.concatenate([rng.normal(0.5, 0.01, 600), rng.uniform(0, 1, 200)])
+    for distance in (0.0005, 0.002, 0.02):
+        labels, exact = link_points(lon, lat, distance)
+        assert exact
+        assert same_partition(labels, brute_force_labels(lon, lat, distance))
+
+
+def test_link_points_over_budget(monkeypatch):
+    # Past MAX_EXACT_PAIRS, links are only wrong for pairs within the stated
+    # bound of the distance: the result lies between the exact partitions at
+    # distance - bound and distance + bound.
+    monkeypatch.setattr(marker_snapshot, "MAX_EXACT_PAIRS", 0)
+    rng = np.random.default_rng(3)
+    lon, lat = rng.uniform(0, 1, 500), rng.uniform(0, 1, 500)
+    distance = 0.04
+    bound = distance * math.sqrt(2) / marker_snapshot.LINK_STEPS
+    labels, exact = link_points(lon, lat, distance)
+    assert not exact
+    finer = brute_force_labels(lon, lat, distance - bound)
+    coarser = brute_force_labels(lon, lat, distance + bound)
+    assert len(set(zip(finer.tolist(), labels.tolist()))) == len(set(finer.tolist()))
+    assert len(set(zip(labels.tolist(), coarser.tolist()))) == len(set(labels.tolist()))
+
+
+def test_cluster_points_matches_brute_force():
+    rng = np.random.default_rng(11)
+    lon, lat = rng.uniform(2.3, 2.4, 400), rng.uniform(48.8, 48.9, 400)
+    for distance in (0.001, 0.004, 0.01):
+        expected = brute_force_labels(lon, lat, distance)
+        clusters = sorted(
+            (int((expected == c).sum()), float(lon[expected == c].mean()), float(lat[expected == c].mean()))
+            for c in np.unique(expected)
+        )
+        cx, cy, counts = cluster_points(lon, lat, distance)
+        actual = sorted(zip(counts.tolist(), cx.tolist(), cy.tolist()))
+        assert [c[0] for c in actual] == [c[0] for c in clusters]
+        assert np.allclose(actual, clusters, rtol=0, atol=1e-9)
+
+
+def test_clusters_count_all_markers(snapshot):
+    snap, _ = snapshot
+    idx = snap.query(*BBOXES[1])
+    clusters = snap.clusters(idx, 0.005)
+    assert sum(c["cluster_count"] for c in clusters) == len(idx)
+    assert len(clusters) == len(np.unique(brute_force_labels(snap.lon[idx], snap.lat[idx], 0.005)))
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Route parsing of /markers/along: encoded polylines, GeoJSON lines and limits.
+
+Usage: python -m pytest tests/test_route_geometry.py
+"""
+
+import os
+import sys
+import json
+
+import pytest
+
+ROOT_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT_DIR, "src"))
+
+from route_geometry import (
+    MAX_ROUTE_POINTS, MAX_ROUTE_PIECES, ROUTE_PIECE_DEGREES,
+    decode_polyline, parse_route, route_piece_count,
+)
+
+# Example of the polyline algorithm documentation (lat, lng points).
+GOOGLE_EXAMPLE = "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+GOOGLE_EXAMPLE_POINTS = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+
+
+def test_decode_google_example():
+    coords = decode_polyline(GOOGLE_EXAMPLE)
+    assert len(coords) == len(GOOGLE_EXAMPLE_POINTS)
+    for (lon, lat), (expected_lat, expected_lng) in zip(coords, GOOGLE_EXAMPLE_POINTS):
+        assert (lon, lat) == pytest.approx((expected_lng, expected_lat), abs=1e-9)
+
+
+def test_decode_single_point_and_empty():
+    # "??" encodes a zero delta for both coordinates.
+    assert decode_polyline("??") == [[0.0, 0.0]]
+    assert decode_polyline("") == []
+
+
+def test_decode_precision():
+    # The same points at six decimal places.
+    coords = decode_polyline("_izlhA~rlgdF_{geC~ywl@_kwzCn`{nI", precision=6)
+    assert coords == decode_polyline(GOOGLE_EXAMPLE)
+
+
+@pytest.mark.parametrize("encoded", ["_p~iF", "_p~iF~ps|U_", "_"])
+def test_decode_truncated(encoded):
+    with pytest.raises(ValueError):
+        decode_polyline(encoded)
+
+
+def test_parse_route_polyline():
+    assert parse_route(None, GOOGLE_EXAMPLE) == decode_polyline(GOOGLE_EXAMPLE)
+
+
+def test_parse_route_geojson():
+    line = {"type": "LineString", "coordinates": [[5.72, 45.18], ["5.73", 45.19]]}
+    assert parse_route(line, None) == [[5.72, 45.18], [5.73, 45.19]]
+    assert parse_route(json.dumps(line), None) == [[5.72, 45.18], [5.73, 45.19]]
+
+
+@pytest.mark.parametrize("line, polyline", [
+    (None, None),
+    ({"type": "Point", "coordinates": [5.72, 45.18]}, None),
+    ({"type": "LineString", "coordinates": [[5.72, 45.18]]}, None),
+    ({"type": "LineString", "coordinates": [[5.72, 45.18], [200.0, 45.19]]}, None),
+    ({"type": "LineString", "coordinates": [[5.72, 45.18], [float("nan"), 45.19]]}, None),
+    ({"type": "LineString", "coordinates": [[5.72, 45.18]] * (MAX_ROUTE_POINTS + 1)}, None),
+    ("[1, 2]", None),
+    (None, "??"),
+])
+def test_parse_route_rejects_invalid(line, polyline):
+    with pytest.raises(ValueError):
+        parse_route(line, polyline)
+
+
+def test_route_piece_count():
+    # Pieces are cut per segment, and a zero-length segment is one piece.
+    assert route_piece_count([[0.0, 0.0], [0.001, 0.0]]) == 1
+    assert route_piece_count([[0.0, 0.0], [0.0, 0.0]]) == 1
+    assert route_piece_count([[0.0, 0.0], [0.0, 1.0], [1.0, 1.0]]) == 2 * round(1 / ROUTE_PIECE_DEGREES)
+
+
+def test_route_across_the_globe_is_over_the_limit():
+    assert route_piece_count([[-179.0, -60.0], [179.0, 60.0]]) > MAX_ROUTE_PIECES
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Coalescing and error sharing of SingleFlight.
+
+Usage: python -m pytest tests/test_single_flight.py
+"""
+
+import os
+import sys
+import time
+import threading
+
+import pytest
+
+ROOT_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT_DIR, "src"))
+
+from single_flight import SingleFlight, SingleFlightInterrupted
+
+FOLLOWERS = 5
+
+
+def run_concurrently(flight, key, fn, followers=FOLLOWERS):
+    """
+    Call flight.do(key, fn) in a leader thread, wait until `followers` more
+    threads have joined its call, then let fn finish. Returns the outcome of
+    each thread (leader first) as ("ok", result) or ("error", exception).
+    """
+    release = threading.Event()
+    started = threading.Event()
+    outcomes = [None] * (followers + 1)
+
+    def blocking():
+        started.set()
+        assert release.wait(5)
+        return fn()
+
+    def call(i, target):
+        try:
+            outcomes[i] = ("ok", flight.do(key, target))
+        except BaseException as e:
+            outcomes[i] = ("error", e)
+
+    threads = [threading.Thread(target=call, args=(0, blocking))]
+    threads[0].start()
+    assert started.wait(5)
+    for i in range(1, followers + 1):
+        # Followers would fail the test if they ran their own function.
+        threads.append(threading.Thread(target=call, args=(i, lambda: pytest.fail("not coalesced"))))
+        threads[-1].start()
+    deadline = time.monotonic() + 5
+    while flight.calls[key].shared < followers:
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    return outcomes
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    calls = []
+    result = ["row"]
+
+    def fn():
+        calls.append(1)
+        return result
+
+    outcomes = run_concurrently(flight, "q", fn)
+    assert len(calls) == 1
+    assert all(kind == "ok" and value is result for kind, value in outcomes)
+    assert flight.calls == {}
+
+
+def test_results_are_not_cached():
+    flight = SingleFlight()
+    counter = iter(range(10))
+    assert flight.do("q", lambda: next(counter)) == 0
+    assert flight.do("q", lambda: next(counter)) == 1
+
+
+def test_distinct_keys_run_separately():
+    flight = SingleFlight()
+    assert flight.do("a", lambda: "a") == "a"
+    assert flight.do("b", lambda: "b") == "b"
+
+
+def test_exception_is_shared():
+    flight = SingleFlight()
+    error = ValueError("query failed")
+
+    def fn():
+        raise error
+
+    outcomes = run_concurrently(flight, "q", fn)
+    assert all(kind == "error" and value is error for kind, value in outcomes)
+    assert flight.calls == {}
+
+
+@pytest.mark.parametrize("interruption", [SystemExit(1), KeyboardInterrupt()])
+def test_interrupted_call_fails_followers(interruption):
+    flight = SingleFlight()
+
+    def fn():
+        raise interruption
+
+    outcomes = run_concurrently(flight, "q", fn)
+    assert outcomes[0] == ("error", interruption)
+    for kind, value in outcomes[1:]:
+        # Never a None result passed off as the answer.
+        assert kind == "error" and isinstance(value, SingleFlightInterrupted)
+        assert value.__cause__ is interruption
+    assert flight.calls == {}
+    assert flight.do("q", lambda: "again") == "again"